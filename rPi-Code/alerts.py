@@ -0,0 +1,147 @@
+"""
+Title: Augmented Warfighter Awareness System Alert Engine
+Team: UCCS Senior Design "Heads Up" 2020
+
+Purpose: This file turns color band changes into alert events as sensor
+         data arrives. Only cells whose value changed (or that are waiting
+         out a debounce) are re-classified, and an event is raised only
+         when a warrior's field settles into a different band, with a
+         deadband around each threshold so a noisy reading does not flap.
+         Events go to listeners, e.g. the message pane and subscribed
+         clients.
+
+"""
+import numpy as np
+import classify
+import stats
+
+### <<< HYSTERESIS >>> ###
+# To improve a band, a reading must clear the threshold by this much
+# (in classify.FIELD_* order; the weapon value is a code, so none)
+HYSTERESIS              =   [2, 0.1, 3, 1, 0.3, 1, 0]
+
+# A new band must hold this long (seconds of sample time) to be reported
+DEBOUNCE_SECONDS        =   2.0
+
+NO_BAND                 =   -1
+
+class AlertEvent(object):
+    __slots__ = ["timestamp", "warrior", "field", "oldBand", "newBand", "value"]
+
+    def __init__(self, timestamp, warrior, field, oldBand, newBand, value):
+        self.timestamp = timestamp
+        self.warrior = warrior      # Warrior ID
+        self.field = field          # classify.FIELD_*
+        self.oldBand = oldBand      # classify.BAND_*
+        self.newBand = newBand
+        self.value = value
+
+    def __str__(self):
+        return "W{} {} {} {}->{}".format(self.warrior, classify.FIELD_NAMES[self.field].upper(),
+            formatValue(self.value), classify.BAND_NAMES[self.oldBand], classify.BAND_NAMES[self.newBand])
+
+class AlertEngine(object):
+    """ Tracks the reported band of every (warrior, field).
+
+        A reading worse than the reported band becomes the candidate band
+        straight away. A better one only counts if it would still be better
+        with HYSTERESIS pushed toward the worse side of every threshold.
+        A candidate must then hold for DEBOUNCE_SECONDS before it replaces
+        the reported band and an AlertEvent is raised. """
+
+    def __init__(self, sensorStore, hysteresis=HYSTERESIS, debounce=DEBOUNCE_SECONDS):
+        self.sensorStore = sensorStore
+        self.classifier = classify.getClassifier()
+        self.hysteresis = np.array(hysteresis, dtype=np.float64)
+        self.debounce = debounce
+
+        self.lastValues = None
+        self.bands = None
+        self.pendingBand = None
+        self.pendingSince = None
+
+        # Called with a list of AlertEvents (on the store writer's thread)
+        self.listeners = []
+
+        self.updateTime = stats.registry.histogram("alerts.update")
+        self.cellsEvaluated = stats.registry.counter("alerts.cellsEvaluated")
+        self.events = stats.registry.counter("alerts.events")
+
+    def addListener(self, listener):
+        self.listeners.append(listener)
+
+    def start(self):
+        self.sensorStore.addListener(self.onData)
+
+    def onData(self, count):
+        events = self.update(self.sensorStore.latest(), self.sensorStore.latestTime())
+        if(events):
+            for listener in self.listeners:
+                listener(events)
+
+    def update(self, values, timestamp):
+        # values: (warriors, FIELD_TOTAL); returns the AlertEvents raised
+        start = stats.now()
+        values = np.array(values, dtype=np.float64)
+
+        if(self.lastValues is None):
+            # Whatever the squad looks like at startup is not news
+            self.bands = self.classifier.classify(values)
+            self.bands[np.isnan(values)] = NO_BAND
+            self.pendingBand = np.full(values.shape, NO_BAND, dtype=np.int8)
+            self.pendingSince = np.zeros(values.shape)
+            self.lastValues = values
+            return []
+
+        changed = ~((values == self.lastValues) | (np.isnan(values) & np.isnan(self.lastValues)))
+        (rows, fields) = np.nonzero(changed | (self.pendingBand != NO_BAND))
+        self.lastValues = values
+        self.cellsEvaluated.add(len(rows))
+        if(not len(rows)):
+            self.updateTime.recordSince(start)
+            return []
+
+        # A first reading (or a lost one) sets the band quietly: a sensor
+        # coming online is not a change in the warrior's condition
+        cells = values[rows, fields]
+        unread = np.isnan(cells) | (self.bands[rows, fields] == NO_BAND)
+        if(unread.any()):
+            (quietRows, quietFields) = (rows[unread], fields[unread])
+            self.bands[quietRows, quietFields] = np.where(np.isnan(cells[unread]), NO_BAND,
+                self.classifier.classifyCells(cells[unread], quietFields))
+            self.pendingBand[quietRows, quietFields] = NO_BAND
+            (rows, fields, cells) = (rows[~unread], fields[~unread], cells[~unread])
+
+        deadband = self.hysteresis[fields]
+        raw = self.classifier.classifyCells(cells, fields)
+        cautious = np.maximum(raw, np.maximum(self.classifier.classifyCells(cells - deadband, fields),
+                                              self.classifier.classifyCells(cells + deadband, fields)))
+
+        current = self.bands[rows, fields]
+        candidate = np.where(raw > current, raw, np.where(cautious < current, cautious, current))
+
+        # Settled back where it was: forget any pending change
+        settled = candidate == current
+        self.pendingBand[rows[settled], fields[settled]] = NO_BAND
+
+        # A new candidate starts its debounce now
+        pending = self.pendingBand[rows, fields]
+        restart = ~settled & (candidate != pending)
+        self.pendingBand[rows[restart], fields[restart]] = candidate[restart]
+        self.pendingSince[rows[restart], fields[restart]] = timestamp
+
+        due = ~settled & (timestamp - self.pendingSince[rows, fields] >= self.debounce)
+        events = []
+        for i in np.nonzero(due)[0]:
+            (row, field) = (rows[i], fields[i])
+            events.append(AlertEvent(timestamp, int(self.sensorStore.ids[row]), int(field),
+                                     int(current[i]), int(candidate[i]), float(cells[i])))
+            self.bands[row, field] = candidate[i]
+            self.pendingBand[row, field] = NO_BAND
+
+        self.events.add(len(events))
+        self.updateTime.recordSince(start)
+        return events
+
+def formatValue(value):
+    return str(int(value)) if float(value).is_integer() else "{:.1f}".format(value)
@@ -0,0 +1,250 @@
+"""
+Title: Augmented Warfighter Awareness System Benchmarks
+Team: UCCS Senior Design "Heads Up" 2020
+
+Purpose: This file measures the hot paths headless on any Linux box: display
+         frames per second and bytes per frame (written to /dev/null or a
+         pty), client message and color change throughput, threshold
+         classification throughput, and Poll round-trip latency over
+         loopback. Results are written as JSON so runs on different commits
+         can be compared.
+
+         python3 bench.py [--output bench.json] [--terminal null|pty|framebuffer]
+
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import pty
+import socket
+import subprocess
+import time
+from threading import Event, Thread
+import numpy as np
+import display
+import classify
+import framebuffer
+import server
+from loadgen import SensorLoadGenerator
+from sensorstore import SensorStore
+
+### <<< DEFAULTS >>> ###
+BENCH_SEED              =   2020
+DISPLAY_SECONDS         =   5.0
+DISPLAY_WARRIORS        =   1000
+UNCAPPED_FPS            =   10000   # Frame cap while measuring the render loop
+MESSAGE_COUNT           =   2000
+COLOR_COUNT             =   20000
+CLASSIFY_WARRIORS       =   [3, 100, 10000]
+CLASSIFY_REPEATS        =   50
+POLL_CLIENTS            =   [1, 10, 100]
+POLL_COUNT              =   50      # Round trips per client
+POLL_WARRIORS           =   3
+PERCENTILES             =   [50, 90, 99]
+
+def openTerminal(kind):
+    # Point the shared terminal writer at /dev/null or at a drained pty,
+    # or draw into an in-memory framebuffer instead
+    if(kind == "framebuffer"):
+        display.useBackend(framebuffer.FramebufferWriter())
+    elif(kind == "pty"):
+        (master, slave) = pty.openpty()
+
+        def drain():
+            while(1):
+                try:
+                    os.read(master, 65536)
+                except OSError:
+                    return
+
+        Thread(target=drain, daemon=True).start()
+        display.terminal.fd = slave
+    else:
+        display.terminal.fd = os.open(os.devnull, os.O_WRONLY)
+
+def waitForTerminal(timeout=5.0):
+    # Let the writer thread empty its queue so counters are settled
+    end = time.monotonic() + timeout
+    while(not display.terminal.commandQueue.empty() and time.monotonic() < end):
+        time.sleep(0.01)
+    time.sleep(0.05)
+
+def percentiles(samples):
+    samples = np.asarray(samples, dtype=np.float64) * 1000
+    result = dict([("p" + str(p), float(np.percentile(samples, p))) for p in PERCENTILES])
+    result["mean"] = float(samples.mean())
+    result["max"] = float(samples.max())
+    return result
+
+### <<< DISPLAY >>> ###
+def benchDisplay(seconds=DISPLAY_SECONDS, warriors=DISPLAY_WARRIORS):
+    # displayData driven as fast as possible by a load generator
+    generator = SensorLoadGenerator(warriors, BENCH_SEED)
+    sensorStore = SensorStore(generator.ids)
+
+    service = display.MessagePrintService()
+    service.scheduler = display.RenderScheduler(UNCAPPED_FPS)
+    service.displayStructure()
+    waitForTerminal()
+
+    stop = Event()
+    threads = [Thread(target=generator.run, args=(sensorStore,), kwargs={"realtime": False, "stop": stop}, daemon=True),
+               Thread(target=service.displayData, args=(None, sensorStore, stop), daemon=True)]
+    for thread in threads:
+        thread.start()
+
+    renderer = service.cellRenderer
+    terminal = display.terminal
+    (frames, bytesWritten, written, dropped) = (renderer.framesDrawn, terminal.bytesWritten,
+                                                terminal.framesWritten, terminal.commandsDropped)
+    time.sleep(seconds)
+    frames = renderer.framesDrawn - frames
+
+    # Nothing may keep running into the benchmarks that follow
+    stop.set()
+    service.scheduler.notifyData()
+    for thread in threads:
+        thread.join()
+    waitForTerminal()
+
+    written = terminal.framesWritten - written
+    bytesWritten = terminal.bytesWritten - bytesWritten
+    return {
+        "warriors": warriors,
+        "seconds": seconds,
+        "frames": frames,
+        "fps": frames / seconds,
+        "samplesAppended": sensorStore.count,
+        "bytesPerFrame": bytesWritten / written if written else 0.0,
+        "commandsDropped": terminal.commandsDropped - dropped}
+
+def benchMessages(count=MESSAGE_COUNT):
+    # Cost to the caller; the pane itself is drawn by the display loop
+    service = display.MessagePrintService()
+
+    start = time.perf_counter()
+    for i in range(count):
+        service.printClientMessage("Poll request from 127.0.0." + str(i % 256))
+    elapsed = time.perf_counter() - start
+
+    return {"messages": count, "perSecond": count / elapsed}
+
+def benchColorText(count=COLOR_COUNT):
+    service = display.MessagePrintService()
+    colors = list(display.COLOR_CODES)
+
+    start = time.perf_counter()
+    for i in range(count):
+        service.colorText(colors[i % len(colors)])
+    elapsed = time.perf_counter() - start
+    waitForTerminal()
+
+    return {"calls": count, "perSecond": count / elapsed}
+
+### <<< CLASSIFICATION >>> ###
+def benchClassify(sizes=CLASSIFY_WARRIORS, repeats=CLASSIFY_REPEATS):
+    classifier = classify.getClassifier()
+    results = []
+
+    for warriors in sizes:
+        values = SensorLoadGenerator(warriors, BENCH_SEED).sample()
+        classifier.classify(values)
+
+        start = time.perf_counter()
+        for i in range(repeats):
+            classifier.classify(values)
+        elapsed = time.perf_counter() - start
+
+        cells = warriors * classify.FIELD_TOTAL * repeats
+        results.append({
+            "warriors": warriors,
+            "cellsPerSecond": cells / elapsed,
+            "nsPerCell": elapsed / cells * 1e9})
+    return results
+
+### <<< POLL ROUND TRIP >>> ###
+async def readReply(reader):
+    # Every text reply ends with the command prompt
+    data = b""
+    while(not data.endswith(b"Command: ")):
+        chunk = await reader.read(65536)
+        if(not chunk):
+            raise ConnectionError("Server closed the connection")
+        data += chunk
+    return data
+
+async def pollClient(port, count, latencies):
+    (reader, writer) = await asyncio.open_connection("127.0.0.1", port)
+    await readReply(reader)
+
+    for i in range(count):
+        start = time.perf_counter()
+        writer.write(b"Poll")
+        await readReply(reader)
+        latencies.append(time.perf_counter() - start)
+
+    writer.close()
+
+async def pollClients(port, clients, count):
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[pollClient(port, count, latencies) for i in range(clients)])
+    return (latencies, time.perf_counter() - start)
+
+def benchPoll(clientCounts=POLL_CLIENTS, count=POLL_COUNT, warriors=POLL_WARRIORS):
+    generator = SensorLoadGenerator(warriors, BENCH_SEED)
+    sensorStore = SensorStore(generator.ids)
+    sensorStore.append(generator.sample())
+
+    serversocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    serversocket.bind(("127.0.0.1", 0))
+    serversocket.listen(max(clientCounts))
+    port = serversocket.getsockname()[1]
+
+    host = server.AsyncServerHost(display.MessagePrintService(), sensorStore, "127.0.0.1", port)
+    Thread(target=host.serve, args=(serversocket,), daemon=True).start()
+
+    results = []
+    for clients in clientCounts:
+        (latencies, elapsed) = asyncio.run(pollClients(port, clients, count))
+        result = {"clients": clients, "polls": len(latencies), "pollsPerSecond": len(latencies) / elapsed}
+        result["latencyMs"] = percentiles(latencies)
+        results.append(result)
+    return results
+
+### <<< REPORT >>> ###
+def commitId():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def runAll(terminalKind):
+    openTerminal(terminalKind)
+
+    return {
+        "commit": commitId(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "terminal": terminalKind,
+        "display": benchDisplay(),
+        "printClientMessage": benchMessages(),
+        "colorText": benchColorText(),
+        "classify": benchClassify(),
+        "poll": benchPoll()}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="AWAS headless benchmarks")
+    parser.add_argument("--output", default="bench.json", help="JSON results file")
+    parser.add_argument("--terminal", choices=["null", "pty", "framebuffer"], default="null", help="Where display output goes")
+    args = parser.parse_args()
+
+    results = runAll(args.terminal)
+    with open(args.output, "w") as output:
+        json.dump(results, output, indent=2)
+
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,154 @@
+"""
+Title: Augmented Warfighter Awareness System Threshold Classification
+Team: UCCS Senior Design "Heads Up" 2020
+
+Purpose: This file compiles the sensor color band constants from display.py
+         into a single threshold table, and classifies whole batches of
+         sensor readings (warriors x fields) into color bands with NumPy.
+
+"""
+import numpy as np
+import display
+
+### <<< FLAT FIELD ORDER >>> ###
+# Column order used when a warrior record is flattened into one row
+FIELD_AMMO              =   0
+FIELD_WATER             =   1
+FIELD_HR                =   2
+FIELD_SPO2              =   3
+FIELD_TEMP              =   4
+FIELD_RESP              =   5
+FIELD_WEAPON            =   6
+FIELD_TOTAL             =   7
+
+FIELD_NAMES             =   ["ammo", "water", "hr", "spo2", "temp", "resp", "weapon"]
+FIELD_INDEX             =   dict([(name, field) for (field, name) in enumerate(FIELD_NAMES)])
+
+### <<< COLOR BANDS >>> ###
+# Ordered from best to worst so the worse of two bands is the larger code
+BAND_GREEN              =   0
+BAND_AMBER              =   1
+BAND_RED                =   2
+BAND_BLACK              =   3
+
+BAND_NAMES              =   ["green", "amber", "red", "black"]
+BAND_INDEX              =   dict([(name, band) for (band, name) in enumerate(BAND_NAMES)])
+BAND_COLORS             =   ["green", "yellow", "red", "blue"]   # Black doesn't show up well
+
+# Every field is described by this many scales; the band is the worst of them
+SCALES_PER_FIELD        =   2
+
+# Each scale gets its own stretch of the number line this wide
+SCALE_SPAN              =   2.0 ** 20
+
+def flattenRecord(record):
+    # [ID, ammo, water, [hr, spo2, temp, resp], weapon] -> field order above
+    vitals = record[display.VITALS_DATA]
+    return [record[display.AMMO_DATA], record[display.WATER_DATA],
+            vitals[display.HR_DATA], vitals[display.SPO2_DATA],
+            vitals[display.TEMP_DATA], vitals[display.RESP_DATA],
+            record[display.WEAPON_DATA]]
+
+def flattenSensorData(sensorData):
+    # One row per warrior, one column per field
+    return np.array([flattenRecord(record) for record in sensorData], dtype=np.float64)
+
+class ThresholdClassifier(object):
+    """ Classifies readings into BAND_* codes.
+
+        Each field is described by scales of sorted edges plus a band lookup
+        (higher-is-better fields like ammo use one scale, two-sided vitals
+        like HR use a low and a high scale). All scales are compiled once
+        into a single sorted edge array, each scale shifted onto its own
+        SCALE_SPAN wide stretch, so a whole batch is classified with one
+        np.searchsorted call and no per-cell Python branching. """
+
+    def __init__(self):
+        self.compile()
+
+    def bandScales(self):
+        # (edges, side, lookup) per scale; side "left" means a value equal to
+        # an edge falls in the band below it, "right" in the band above it
+        d = display
+        higherIsBetter = [BAND_BLACK, BAND_RED, BAND_AMBER, BAND_GREEN]
+        lowSide = [BAND_BLACK, BAND_RED, BAND_AMBER, BAND_GREEN]
+        highSide = [BAND_GREEN, BAND_AMBER, BAND_RED, BAND_BLACK]
+
+        def twoSided(green, amber, red):
+            return [([red[d.LOW], amber[d.LOW], green[d.LOW]], "right", lowSide),
+                    ([green[d.HIGH], amber[d.HIGH], red[d.HIGH]], "left", highSide)]
+
+        scales = [None] * FIELD_TOTAL
+        scales[FIELD_AMMO] = [([d.AMMO_BLACK, d.AMMO_RED, d.AMMO_AMBER], "left", higherIsBetter)]
+        scales[FIELD_WATER] = [([d.WATER_BLACK, d.WATER_RED, d.WATER_AMBER], "left", higherIsBetter)]
+        scales[FIELD_SPO2] = [([d.SPO2_BLACK, d.SPO2_RED, d.SPO2_AMBER], "left", higherIsBetter)]
+        scales[FIELD_HR] = twoSided(d.HR_GREEN, d.HR_AMBER, d.HR_RED)
+        scales[FIELD_TEMP] = twoSided(d.TEMP_GREEN, d.TEMP_AMBER, d.TEMP_RED)
+        scales[FIELD_RESP] = twoSided(d.RESP_GREEN, d.RESP_AMBER, d.RESP_RED)
+
+        # 0: never fired & safe, 1: never fired & on fire,
+        # 2 - 11: fired recently (black), above 11: fired a while ago (red)
+        scales[FIELD_WEAPON] = [([d.WEAPON_GREEN, d.WEAPON_AMBER, d.WEAPON_RED], "left",
+                                 [BAND_GREEN, BAND_AMBER, BAND_BLACK, BAND_RED])]
+        return scales
+
+    def compile(self):
+        edges = []
+        lookup = []
+        scaleIds = np.zeros((FIELD_TOTAL, SCALES_PER_FIELD), dtype=np.intp)
+
+        scale = 0
+        for (field, fieldScales) in enumerate(self.bandScales()):
+            # Pad single-scale fields with an edgeless scale that is always green
+            fieldScales = fieldScales + [([], "left", [BAND_GREEN])] * (SCALES_PER_FIELD - len(fieldScales))
+
+            for (slot, (scaleEdges, side, scaleLookup)) in enumerate(fieldScales):
+                for edge in scaleEdges:
+                    edge = edge + scale * SCALE_SPAN
+
+                    # "right" edges become "left" edges one float below
+                    if(side == "right"):
+                        edge = np.nextafter(edge, -np.inf)
+                    edges.append(edge)
+
+                lookup.extend(scaleLookup)
+                scaleIds[field][slot] = scale
+                scale += 1
+
+        # A value of scale k lands on a searchsorted index in
+        # [first edge of k, last edge of k + 1], and the lookup table for k
+        # starts k entries after its first edge, hence lookup[index + k]
+        self.edges = np.array(edges, dtype=np.float64)
+        self.lookup = np.array(lookup, dtype=np.int8)
+        self.scaleIds = scaleIds
+        self.scaleOffsets = scaleIds * SCALE_SPAN
+
+    def classifyScales(self, values, scaleIds, scaleOffsets):
+        values = np.asarray(values, dtype=np.float64)
+        clipped = np.clip(values, -SCALE_SPAN / 2 + 1, SCALE_SPAN / 2 - 1)
+
+        index = np.searchsorted(self.edges, clipped[..., None] + scaleOffsets)
+        bands = self.lookup[index + scaleIds].max(axis=-1)
+
+        # Missing readings are treated as the worst case
+        bands[np.isnan(values)] = BAND_BLACK
+        return bands
+
+    def classify(self, values):
+        # values: (warriors, FIELD_TOTAL) -> band codes of the same shape
+        values = np.asarray(values, dtype=np.float64).reshape(-1, FIELD_TOTAL)
+        return self.classifyScales(values, self.scaleIds, self.scaleOffsets)
+
+    def classifyCells(self, values, fields):
+        # values[i] is a reading of field fields[i]
+        fields = np.asarray(fields, dtype=np.intp)
+        return self.classifyScales(values, self.scaleIds[fields], self.scaleOffsets[fields])
+
+# Compiled once and shared by everything that needs a color band
+classifier = None
+
+def getClassifier():
+    global classifier
+    if(classifier is None):
+        classifier = ThresholdClassifier()
+    return classifier
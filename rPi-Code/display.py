@@ -8,8 +8,15 @@ Purpose: This file is intended as a driver for the 2.8" TFT display,
 
 """
 import time
-from multiprocessing import Value
+from threading import Event, Lock, Thread
+from queue import Queue, Full, Empty
+from collections import deque
+import sys
 import os
+import numpy as np
+import classify
+import sensorstore
+import stats
 #from main import sensorData
 
 RUN = 0
@@ -20,6 +27,11 @@ DEMO = 1
 RUNMODE = RUN
 
 ### <<< SCREEN LAYOUT >>> ###
+#< BORDER >#
+BORDER_TOP_ROW          =   2
+BORDER_HEIGHT           =   19
+BORDER_WIDTH            =   53
+
 #< COLUMNS >#
 TITLE_START             =   10
 SAMPLE_START            =   4
@@ -45,13 +57,26 @@ WEAPON_ROW              =   TITLE_ROW + 9
 CONNECTION_STATUS_ROW   =   3
 CLIENT_MESSAGE_ROW      =   WEAPON_ROW + 2
 
+# Data row of each field, in classify.FIELD_* order
+FIELD_ROWS              =   [AMMO_ROW, WATER_ROW, HR_ROW, SPO2_ROW, TEMP_ROW, RESP_ROW, WEAPON_ROW]
+
 #< CLIENT MESSAGE >#
 MAX_MESSAGE_LENGTH      =   49
 MAX_MESSAGE_LINES       =   5
+MESSAGE_PANE_WIDTH      =   MAX_MESSAGE_LENGTH + 1  # Cleared width of a row, up to the right border
+
+### <<< TERMINAL OUTPUT >>> ###
+WRITER_QUEUE_SIZE       =   256     # Draw commands waiting for the writer thread
+
+### <<< RENDER TIMING >>> ###
+MAX_FPS                 =   10      # Upper limit on frames drawn per second
+
+### <<< WARRIOR VIEWPORT >>> ###
+VIEWPORT_COLUMNS        =   3       # Warrior columns that fit on the TFT
+PAGE_PERIOD             =   5.0     # Seconds before rotating to the next page
 
 ### <<< SENSOR DATA >>> ###
 #< SENSOR DATA ELEMENTS>#
-WARRIOR_TOTAL           =   3
 HIGH                    =   1
 LOW                     =   0
 
@@ -116,27 +141,400 @@ WEAPON_AMBER            = 1         # Has not fired, weapon on fire
 WEAPON_RED              = 11        # Been at least 10 seconds since last firing (weapon on safe or fire)
 WEAPON_BLACK            = [2, 11]   # Been 2 - 10 just a short time since firing (weapon on safe or fire)
 
+#< TEXT COLORS >#
+# ANSI SGR sequences for each pen color
+COLOR_CODES = {
+    "red"       : chr(27) + "[31m",
+    "green"     : chr(27) + "[32m",
+    "yellow"    : chr(27) + "[33m",
+    "blue"      : chr(27) + "[34m",
+    "magenta"   : chr(27) + "[35m",
+    "cyan"      : chr(27) + "[36m",
+    "white"     : chr(27) + "[37m"
+}
+COLOR_BYTES = dict([(color, code.encode()) for (color, code) in COLOR_CODES.items()])
+
+CLEAR_SCREEN = chr(27) + "[2J"
+HIDE_CURSOR = "\033[?25h"
+
+### <<< FRAME COMPOSITION >>> ###
+class Frame(object):
+    """ Collects cursor moves, color codes and text into a single bytes
+        buffer so a whole screen update reaches the terminal in one write.
+        Color switches and cursor moves that would not change anything are
+        left out. The same update is also kept as ops, (row, col, text,
+        color) per text run or (None, None, sequence, None) per raw escape
+        sequence, for backends that don't speak ANSI (see framebuffer.py). """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.ops = []
+        self.color = None       # Pen color at the end of the buffer
+        self.cursor = None      # (row, col) at the end of the buffer, if known
+        self.commands = 0
+        self.queuedAt = 0       # stats.now() when handed to the terminal writer
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def setColor(self, color):
+        if(color is not None and color != self.color):
+            self.buffer += COLOR_BYTES[color]
+            self.color = color
+
+    def moveTo(self, row, col):
+        if((row, col) != self.cursor):
+            self.buffer += b"\x1b[%d;%df" % (row, col)
+            self.cursor = (row, col)
+
+    def text(self, text):
+        self.buffer += text.encode()
+        if(self.cursor is not None):
+            self.ops.append((self.cursor[0], self.cursor[1], text, self.color))
+            self.cursor = (self.cursor[0], self.cursor[1] + len(text))
+
+    def raw(self, sequence):
+        # Arbitrary escape sequence; the cursor position is unknown afterwards
+        self.buffer += sequence.encode()
+        self.ops.append((None, None, sequence, None))
+        self.cursor = None
+
+    def draw(self, row, col, text, color=None):
+        self.setColor(color)
+        self.moveTo(row, col)
+        self.text(text)
+        self.commands += 1
+
+    def tobytes(self):
+        return bytes(self.buffer)
+
+### <<< TERMINAL OUTPUT >>> ###
+class TerminalWriter(object):
+    """ The only thing allowed to write to stdout. Producers hand it whole
+        frames, and a single thread writes them in order so output from
+        different threads can never interleave. Whatever is queued when the
+        thread wakes up is flushed with one os.write. Producers never block:
+        if the queue is full the frame is dropped and counted. """
+
+    # Backends that don't write to a file descriptor turn this off
+    usesStdout = True
+
+    def __init__(self, maxQueue=WRITER_QUEUE_SIZE, fd=None):
+        self.commandQueue = Queue(maxQueue)
+        self.startLock = Lock()
+        self.thread = None
+        self.fd = fd
+
+        self.commandsWritten = 0
+        self.commandsDropped = 0
+        self.framesWritten = 0
+        self.bytesWritten = 0
+        self.writesIssued = 0
+        self.lastWriteBytes = 0
+
+        # Time frames sit in the queue (what producers used to spend waiting
+        # on a lock) and time spent in os.write
+        self.queueWait = stats.registry.histogram("terminal.queueWait")
+        self.writeTime = stats.registry.histogram("terminal.write")
+        stats.registry.gauge("terminal.commandsDropped", lambda: self.commandsDropped)
+        stats.registry.gauge("terminal.bytesWritten", lambda: self.bytesWritten)
+        stats.registry.gauge("terminal.writesIssued", lambda: self.writesIssued)
+
+    def start(self):
+        with self.startLock:
+            if(self.thread is None):
+                if(self.fd is None and self.usesStdout):
+                    # Anything print()ed before now must come out first
+                    sys.stdout.flush()
+                    self.fd = sys.stdout.fileno()
+
+                self.thread = Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def submitFrame(self, frame):
+        if(not len(frame)):
+            return 0
+
+        if(self.thread is None):
+            self.start()
+
+        try:
+            frame.queuedAt = stats.now()
+            self.commandQueue.put_nowait(frame)
+        except Full:
+            self.commandsDropped += frame.commands
+            return 0
+
+        # Number of bytes queued for the terminal
+        return len(frame)
+
+    def submit(self, row, col, text, color=None):
+        # Single draw command; color, position and text stay together
+        frame = Frame()
+        frame.setColor(color)
+        if(row is not None):
+            frame.moveTo(row, col)
+            frame.text(text)
+            frame.commands += 1
+        else:
+            frame.raw(text)
+            frame.commands += 1
+        return self.submitFrame(frame)
+
+    def run(self):
+        while(1):
+            # Block for the first frame, then take whatever else is waiting
+            frames = [self.commandQueue.get()]
+            while(1):
+                try:
+                    frames.append(self.commandQueue.get_nowait())
+                except Empty:
+                    break
+
+            start = stats.now()
+            for frame in frames:
+                self.queueWait.record(start - frame.queuedAt)
+
+            self.lastWriteBytes = self.writeFrames(frames)
+            self.writeTime.recordSince(start)
+
+            self.framesWritten += len(frames)
+            self.commandsWritten += sum([frame.commands for frame in frames])
+            self.bytesWritten += self.lastWriteBytes
+
+    def writeFrames(self, frames):
+        # Output backends override this; returns the number of bytes written
+        data = memoryview(b"".join([frame.buffer for frame in frames]))
+        size = len(data)
+
+        while(len(data)):
+            written = os.write(self.fd, data)
+            data = data[written:]
+            self.writesIssued += 1
+        return size
+
+# Shared by every producer in the process
+terminal = TerminalWriter()
+
+def useBackend(backend):
+    # Send all output somewhere else, e.g. a framebuffer.FramebufferWriter.
+    # Call before anything is drawn.
+    global terminal
+    terminal = backend
+
 ### <<< TFT NAVIGATION >>> ###
 def moveCursor(row, col):
-    print(chr(27) + "[" + str(row) + ";" + str(col) + "f")
+    terminal.submit(row, col, "")
 
 def clearScreen():
-    moveCursor(1,1)
-    print(chr(27) + "[2J")
+    terminal.submit(None, None, CLEAR_SCREEN)
 
 def hideCursor():
-    print("\033[?25h")
+    terminal.submit(None, None, HIDE_CURSOR)
 
 # Print at a certain location on the TFT Screen
-def print_at(row, col, message):
-    print(chr(27) + "[" + str(row) + ";" + str(col) + "f" + message)
+def print_at(row, col, message, color=None):
+    return terminal.submit(row, col, message, color)
+
+### <<< DIRTY CELL RENDERING >>> ###
+class CellRenderer(object):
+    """ Remembers the last value and color drawn in each (row, column) data
+        cell so that a frame only emits escape sequences for cells that
+        actually changed. """
+
+    def __init__(self):
+        # key -> (text, color) last written to the screen
+        self.lastCells = {}
+
+        # Frame being composed and the cells it will draw
+        self.frame = None
+        self.frameKeys = []
+
+        # Statistics for the frame in progress and the last finished frame
+        self.frameCells = 0
+        self.frameBytes = 0
+        self.lastFrameCells = 0
+        self.lastFrameBytes = 0
+        self.framesDrawn = 0
+
+        self.cellTime = stats.registry.histogram("display.cell")
+        self.cellsWritten = stats.registry.counter("display.cellsWritten")
+        self.framesDropped = stats.registry.counter("display.framesDropped")
+
+    def invalidate(self):
+        # Forget everything on screen (e.g. after a clearScreen)
+        self.lastCells.clear()
+
+    def beginFrame(self):
+        self.frame = Frame()
+        self.frameKeys = []
+        self.frameCells = 0
+        self.frameBytes = 0
+
+    def drawAt(self, key, row, col, text, color):
+        # Skip the cell if it already shows this text in this color
+        if(self.lastCells.get(key) == (text, color)):
+            return 0
+
+        self.frame.draw(row, col, text, color)
+        self.lastCells[key] = (text, color)
+        self.frameKeys.append(key)
+        self.frameCells += 1
+        return 1
+
+    def drawCell(self, row, column, text, color):
+        # Data cell in one of the viewport's warrior columns
+        start = stats.now()
+        drawn = self.drawAt((row, column), row, DATA_START + (DATA_SPACING * column), text, color)
+        self.cellTime.recordSince(start)
+        return drawn
+
+    def endFrame(self):
+        # Hand the whole frame to the terminal in one piece
+        self.frameBytes = terminal.submitFrame(self.frame)
+
+        # A dropped frame is not on screen, so leave its cells dirty
+        if(self.frameCells and not self.frameBytes):
+            for key in self.frameKeys:
+                self.lastCells.pop(key, None)
+            self.frameCells = 0
+            self.framesDropped.add()
+
+        self.cellsWritten.add(self.frameCells)
+
+        # Report how many cells and bytes this frame wrote
+        self.lastFrameCells = self.frameCells
+        self.lastFrameBytes = self.frameBytes
+        self.framesDrawn += 1
+        return (self.frameCells, self.frameBytes)
+
+### <<< WARRIOR VIEWPORT >>> ###
+class Viewport(object):
+    """ The window of warrior columns currently on screen. Rosters larger
+        than the viewport are paged through on a timer, or straight away
+        when requestPage() is called (e.g. from a touch event). """
+
+    def __init__(self, columns=VIEWPORT_COLUMNS, pagePeriod=PAGE_PERIOD):
+        self.columns = columns
+        self.pagePeriod = pagePeriod
+        self.first = 0
+
+        self.pageRequested = False
+        self.nextPageTime = time.monotonic() + pagePeriod
+
+    def requestPage(self):
+        self.pageRequested = True
+
+    def update(self, total):
+        # Rotate to the next page when the timer expires or on request
+        if(total <= self.columns):
+            self.first = 0
+            self.pageRequested = False
+            return
+
+        now = time.monotonic()
+        if(self.pageRequested or now >= self.nextPageTime):
+            self.first += self.columns
+            self.pageRequested = False
+            self.nextPageTime = now + self.pagePeriod
+
+        if(self.first >= total):
+            self.first = 0 # cyclic reset
+
+    def visible(self, total):
+        # (first, last) indices of the warriors on screen
+        return (self.first, min(self.first + self.columns, total))
+
+    def deadline(self, total):
+        # When the display loop has to wake up to turn the page
+        if(total <= self.columns):
+            return None
+        return self.nextPageTime
+
+### <<< RENDER SCHEDULING >>> ###
+class RenderScheduler(object):
+    """ Paces the display loop on wall-clock time. Frames are capped at
+        maxFps, and the loop sleeps until notifyData() reports new data or
+        a caller-supplied deadline (e.g. a page turn) passes. """
+
+    def __init__(self, maxFps=MAX_FPS):
+        self.frameInterval = 1.0 / maxFps
+
+        # Set by producers when new sensor data is available
+        # (starts set so the first frame is drawn immediately)
+        self.dataEvent = Event()
+        self.dataEvent.set()
+
+        self.lastFrameTime = 0
+
+    def notifyData(self):
+        # Wake the display loop before its next scheduled frame
+        self.dataEvent.set()
+
+    def waitForFrame(self, deadline=None):
+        # Idle until new data arrives or the deadline passes
+        if(deadline is None):
+            self.dataEvent.wait()
+        else:
+            timeout = deadline - time.monotonic()
+            if(timeout > 0):
+                self.dataEvent.wait(timeout)
+        self.dataEvent.clear()
+
+        # Never draw faster than the frame rate cap
+        delay = self.lastFrameTime + self.frameInterval - time.monotonic()
+        if(delay > 0):
+            time.sleep(delay)
+
+        self.lastFrameTime = time.monotonic()
+
+### <<< MESSAGE PANE >>> ###
+class MessagePane(object):
+    """ The newest client messages, already wrapped to MAX_MESSAGE_LENGTH.
+
+        add() only updates a bounded deque under a short lock, so callers
+        (e.g. the server's event loop) never wait on the terminal; the
+        display loop draws rows() through the CellRenderer, which skips
+        rows that did not change. A message equal to the newest one is
+        folded into it with a repeat count instead of scrolling the pane. """
+
+    def __init__(self, lines=MAX_MESSAGE_LINES, width=MAX_MESSAGE_LENGTH):
+        self.lines = lines
+        self.width = width
+        self.lock = Lock()
+
+        # [text, repeats, wrapped lines], newest first; every message takes
+        # at least one row, so older ones could never be visible
+        self.messages = deque(maxlen=lines)
+
+    def wrap(self, text):
+        return [text[i : i + self.width] for i in range(0, max(len(text), 1), self.width)][:self.lines]
+
+    def add(self, text):
+        stamp = "[" + str(int(time.time()) & 0xFFF) + "]: "
+        with self.lock:
+            if(self.messages and self.messages[0][0] == text):
+                message = self.messages[0]
+                message[1] += 1
+                message[2] = self.wrap(stamp + text + " (x" + str(message[1]) + ")")
+            else:
+                self.messages.appendleft([text, 1, self.wrap(stamp + text)])
+
+    def clear(self):
+        with self.lock:
+            self.messages.clear()
+
+    def rows(self):
+        # Text of each pane row, top to bottom
+        with self.lock:
+            rows = [line for message in self.messages for line in message[2]][:self.lines]
+        return rows + [""] * (self.lines - len(rows))
 
 ### <<< HANDLE TFT MESSAGE PRINTING >>> ###
 class MessagePrintService(object):
     def __init__(self):
-        self.messageLines = [None] * MAX_MESSAGE_LINES
-
-        self.colorText_Mutex = Value("i", 0)
+        # Client messages, drawn by displayData
+        self.messagePane = MessagePane()
 
         self.messageColor   = "red"
         self.warriorColor   = "white"
@@ -145,297 +543,155 @@ class MessagePrintService(object):
         self.titleColor     = "green"
         self.borderColor    = "white"
 
-        self.sample_counter = 0
-        self.delay_counter   = 0
+        # Wall-clock pacing for displayData
+        self.scheduler = RenderScheduler()
+
+        # Shared threshold table for the color bands
+        self.classifier = classify.getClassifier()
+
+        # Warrior columns currently on screen
+        self.viewport = Viewport()
+
+        # Only redraws data cells whose value or color changed
+        self.cellRenderer = CellRenderer()
+
+        self.renderTime = stats.registry.histogram("display.render")
+        self.messageTime = stats.registry.histogram("display.message")
 
     def displayStructure(self):
+        # The structure overwrites every data cell, so redraw them all next frame
+        self.cellRenderer.invalidate()
+        self.scheduler.notifyData()
+
+        # The whole structure is sent to the terminal as one frame
+        frame = Frame()
+
         #< BORDER >#
-        moveCursor(1,1)
-        self.colorText(self.borderColor)
-        print("*****************************************************")
-        print("*                                                   *")
-        print("*                                                   *")
-        print("*                                                   *")
-        print("*                                                   *")
-        print("*                                                   *")
-        print("*                                                   *")
-        print("*                                                   *")
-        print("*                                                   *")
-        print("*                                                   *")
-        print("*                                                   *")
-        print("*                                                   *")
-        print("*                                                   *")
-        print("*                                                   *")
-        print("*                                                   *")
-        print("*                                                   *")
-        print("*                                                   *")
-        print("*                                                   *")
-        print("*****************************************************")
+        for row in range(BORDER_HEIGHT):
+            if(row == 0 or row == BORDER_HEIGHT - 1):
+                frame.draw(BORDER_TOP_ROW + row, 1, "*" * BORDER_WIDTH, self.borderColor)
+            else:
+                frame.draw(BORDER_TOP_ROW + row, 1, "*" + " " * (BORDER_WIDTH - 2) + "*", self.borderColor)
 
         #< TITLE >#
-        self.colorText(self.titleColor)
-        print_at(TITLE_ROW, TITLE_START, "AUGMENTED WARFIGHTER AWARENESS SYSTEM")        
+        frame.draw(TITLE_ROW, TITLE_START, "AUGMENTED WARFIGHTER AWARENESS SYSTEM", self.titleColor)
 
-        #< WARRIOR LABELS >#
-        self.colorText(self.warriorColor)
-        print_at(WARRIOR_NAME_ROW, WARRIOR_NAME_START,  "Warrior 1")
-        print_at(WARRIOR_NAME_ROW, WARRIOR_NAME_START + WARRIOR_NAME_SPACING,  "Warrior 2")
-        print_at(WARRIOR_NAME_ROW, WARRIOR_NAME_START + WARRIOR_NAME_SPACING * 2,  "Warrior 3")
+        # Warrior labels depend on the viewport and are drawn by displayData
 
         #< SENSOR LABELS >#
-        self.colorText(self.dataNameColor)
-        print_at(AMMO_ROW, DATA_NAME_START,     "Ammo   :")
-        print_at(WATER_ROW, DATA_NAME_START,    "Water  :")
-        print_at(HR_ROW, DATA_NAME_START,       "HR     :")
-        print_at(SPO2_ROW, DATA_NAME_START,     "SPO2   :")
-        print_at(TEMP_ROW, DATA_NAME_START,     "Temp   :")
-        print_at(RESP_ROW, DATA_NAME_START,     "Resp   :")
-        print_at(WEAPON_ROW, DATA_NAME_START,   "Weapon :")
+        frame.draw(AMMO_ROW, DATA_NAME_START,     "Ammo   :", self.dataNameColor)
+        frame.draw(WATER_ROW, DATA_NAME_START,    "Water  :", self.dataNameColor)
+        frame.draw(HR_ROW, DATA_NAME_START,       "HR     :", self.dataNameColor)
+        frame.draw(SPO2_ROW, DATA_NAME_START,     "SPO2   :", self.dataNameColor)
+        frame.draw(TEMP_ROW, DATA_NAME_START,     "Temp   :", self.dataNameColor)
+        frame.draw(RESP_ROW, DATA_NAME_START,     "Resp   :", self.dataNameColor)
+        frame.draw(WEAPON_ROW, DATA_NAME_START,   "Weapon :", self.dataNameColor)
+
+        terminal.submitFrame(frame)
     
     def clearMessagePane(self):
-        self.colorText(self.borderColor)
-        print_at(CLIENT_MESSAGE_ROW, CLIENT_MESSAGE_START, "                                                   ")
-        self.colorText(self.borderColor)
-        print_at(CLIENT_MESSAGE_ROW + 1, 1,                "*                                                   *")
-        self.colorText(self.borderColor)
-        print_at(CLIENT_MESSAGE_ROW + 2, 1,                "*                                                   *")
-        self.colorText(self.borderColor)
-        print_at(CLIENT_MESSAGE_ROW + 3, 1,                "*                                                   *")
-        self.colorText(self.borderColor)
-        print_at(CLIENT_MESSAGE_ROW + 4, 1,                "*                                                   *")
-    
-    def shiftMessagePane(self, numLines):
-
-        # Shift Messages 
-        for i in range(numLines):
-            for j in range(MAX_MESSAGE_LINES - 1, 0, -1):
-                self.messageLines[j] = self.messageLines[j - 1]
-        
-        # Re-print messages 
-        for k in range(MAX_MESSAGE_LINES):
-            if(self.messageLines[k] is not None):
-                self.colorText(self.borderColor)
-                print_at(CLIENT_MESSAGE_ROW + k, CLIENT_MESSAGE_START, "                                                  *")
-                self.colorText(self.messageColor)
-                print_at(CLIENT_MESSAGE_ROW + k, CLIENT_MESSAGE_START, self.messageLines[k])
+        self.messagePane.clear()
+        self.scheduler.notifyData()
 
     def printClientMessage(self, message):
-        # Add concatenated timestamp to message
-        message = "[" + str(int(time.time()) & 0xFFF) + "]: " + str(message)
-
-        # Check length of message
-        messageLength = len(message)
-        messagesRequired = 1
-        
-        # If message is too long, count how many messages will be needed?
-        while(messageLength > MAX_MESSAGE_LENGTH):
-            messagesRequired += 1
-            messageLength -= MAX_MESSAGE_LENGTH
+        # Queue the message for the next frame; never touches the terminal
+        start = stats.now()
+        self.messagePane.add(str(message))
+        self.scheduler.notifyData()
+        self.messageTime.recordSince(start)
+
+    def drawMessagePane(self):
+        # Only rows whose text changed since the last frame are sent
+        for (row, text) in enumerate(self.messagePane.rows()):
+            self.cellRenderer.drawAt(("message", row), CLIENT_MESSAGE_ROW + row, CLIENT_MESSAGE_START,
+                text.ljust(MESSAGE_PANE_WIDTH), self.messageColor)
+
+    def nextPage(self):
+        # Show the next page of warriors (e.g. on a touch event)
+        self.viewport.requestPage()
+        self.scheduler.notifyData()
+
+    def drawWarriorLabels(self, ids, first, last):
+        for column in range(self.viewport.columns):
+            if(first + column < last):
+                label = "Warrior " + str(ids[first + column])
+            else:
+                label = ""
 
-        # Shift the message pane to make room for new messages
-        self.shiftMessagePane(messagesRequired)
+            # Pad so a shorter label overwrites a longer one
+            self.cellRenderer.drawAt(("label", column), WARRIOR_NAME_ROW,
+                WARRIOR_NAME_START + WARRIOR_NAME_SPACING * column,
+                label.ljust(WARRIOR_NAME_SPACING - 1), self.warriorColor)
 
-        # Clear the first message row (Bugfix)
-        self.colorText(self.borderColor)
-        print_at(CLIENT_MESSAGE_ROW, CLIENT_MESSAGE_START, "                                                  *")
-        
-        # Change the pen color to messageColor
-        self.colorText(self.messageColor)
-
-        # Create a messages list to split the messages into
-        if(messagesRequired > 1):
-            # Re-discover message length
-            messageLength = len(message)
-
-            # Track how many messages have been parsed
-            messagesParsed = 0
-
-            while(messagesParsed < messagesRequired and messageLength > MAX_MESSAGE_LENGTH) and messagesParsed < MAX_MESSAGE_LINES:
-                
-                # Store message to messageLines (for shifting purposes)
-                self.messageLines[messagesParsed] = str(message[ messagesParsed*MAX_MESSAGE_LENGTH : (messagesParsed + 1)*MAX_MESSAGE_LENGTH ])
-
-                # Print the message that was stored
-                print_at(CLIENT_MESSAGE_ROW + messagesParsed, CLIENT_MESSAGE_START, self.messageLines[messagesParsed])
-
-                # Iterate how many messages have been parsed
-                messagesParsed += 1
-
-                # Reduce remaining message length to be parsed
-                messageLength -= MAX_MESSAGE_LENGTH
-
-            # Check if there is any leftover message
-            if(messageLength > 0 and messagesParsed < MAX_MESSAGE_LINES):
-                # Store the message to messageLines (for shifting purposes)
-                self.messageLines[messagesParsed] = str(message[ messagesParsed*MAX_MESSAGE_LENGTH : len(message) ])
-                
-                # Print the message that was stored
-                print_at(CLIENT_MESSAGE_ROW + messagesParsed, CLIENT_MESSAGE_START, self.messageLines[messagesParsed])
-            
+        # Page indicator, only needed when not everyone fits
+        if(len(ids) > self.viewport.columns):
+            page = str(first + 1) + "-" + str(last) + " of " + str(len(ids))
         else:
-            # Just print the single message
-            self.messageLines[0] = str(message)
-            print_at(CLIENT_MESSAGE_ROW, CLIENT_MESSAGE_START, self.messageLines[0])
-
-    def displayData(self, connectionStatus, sensorData_packages):
-        while(1):
-            # Iterate through the sample data
-            if(self.sample_counter < 3):
-
-                # Apply a delay to make the changing data observable
-                if(self.delay_counter >= 2000):
-                    self.sample_counter += 1
-                    self.delay_counter = 0 # cyclic reset
+            page = ""
+        # Padded to the widest indicator ("1000-1000 of 1000") so no digits are left behind
+        width = 3 * len(str(len(ids))) + len("- of ")
+        self.cellRenderer.drawAt(("page",), SAMPLE_ROW, SAMPLE_START, page.ljust(width), self.dataNameColor)
+
+    def onData(self, count):
+        # Store listener; runs on the writer's thread
+        self.scheduler.notifyData()
+
+    def displayData(self, connectionStatus, sensorStore, stop=None):
+        # Redraw whenever new data lands in the store, until stop (an Event) is set
+        sensorStore.addListener(self.onData)
+
+        while(stop is None or not stop.is_set()):
+            # Sleep until new data or messages arrive or a page turn is due
+            self.scheduler.waitForFrame(self.viewport.deadline(len(sensorStore)))
+            start = stats.now()
+
+            self.cellRenderer.beginFrame()
+            self.drawMessagePane()
+
+            if(sensorStore.count): #< Something received yet
+                self.drawData(sensorStore)
+
+            # Report how many cells and bytes this frame wrote
+            self.cellRenderer.endFrame()
+            self.renderTime.recordSince(start)
+
+    def drawData(self, sensorStore):
+        # Only the warriors in the viewport are classified and drawn
+        self.viewport.update(len(sensorStore))
+        (first, last) = self.viewport.visible(len(sensorStore))
+
+        self.drawWarriorLabels(sensorStore.ids, first, last)
+
+        # One copy of the newest sample for both colors and text, so a sample
+        # appended mid-frame can't pair one reading with another's color
+        latest = np.array(sensorStore.latest(first, last))
+
+        # Determine the color status of every cell in one batch
+        bands = self.classifier.classify(latest)
+        values = sensorstore.toNumbers(latest)
+
+        # Print Data
+        for field in range(classify.FIELD_TOTAL):
+            for i in range(len(values)):
+                value = values[i][field]
+                if(value is None): #< No reading yet
+                    self.cellRenderer.drawCell(FIELD_ROWS[field], i, "--    ", self.dataColor)
                 else:
-                    self.delay_counter += 1
-            else:
-                self.sample_counter = 0 # cyclic reset
-            
-            # redundant check (Bugfix)
-            if(self.sample_counter == 3):
-                self.sample_counter = 0
-
-            # Select the current sample data
-            sensorData = sensorData_packages[self.sample_counter]
-
-            #< AMMO >#
-            # Determine Color Status
-            for i in range(WARRIOR_TOTAL):
-                if(sensorData[i][AMMO_DATA] > AMMO_AMBER and sensorData[i][AMMO_DATA] <= AMMO_GREEN):
-                    self.colorText("green")
-                elif(sensorData[i][AMMO_DATA] > AMMO_RED and sensorData[i][AMMO_DATA] <= AMMO_AMBER):
-                    self.colorText("yellow")
-                elif(sensorData[i][AMMO_DATA] > AMMO_BLACK and sensorData[i][AMMO_DATA] <= AMMO_RED):
-                    self.colorText("red")
-                elif(sensorData[i][AMMO_DATA] <= AMMO_BLACK):
-                    self.colorText("blue")
-
-                # Print Data
-                print_at(AMMO_ROW, DATA_START + (DATA_SPACING * i), str(sensorData[i][AMMO_DATA]) + "   ") 
-
-            #< WATER >#
-            for i in range(WARRIOR_TOTAL):
-                # Determine Color Status
-                if(sensorData[i][WATER_DATA] > WATER_AMBER):
-                    self.colorText("green")
-                elif(sensorData[i][WATER_DATA] > WATER_RED and sensorData[i][WATER_DATA] <= WATER_AMBER):
-                    self.colorText("yellow")
-                elif(sensorData[i][WATER_DATA] > WATER_BLACK and sensorData[i][WATER_DATA] <= WATER_RED):
-                    self.colorText("red")
-                elif(sensorData[i][WATER_DATA] <= WATER_BLACK):
-                    self.colorText("blue")
-
-                # Print Data
-                print_at(WATER_ROW, DATA_START + (DATA_SPACING * i), str(sensorData[i][WATER_DATA]) + "   ") 
-
-            #< HR >#
-            for i in range(WARRIOR_TOTAL):
-                # Determine Color Status
-                if(sensorData[i][VITALS_DATA][HR_DATA] >= HR_GREEN[LOW] and sensorData[i][VITALS_DATA][HR_DATA] <= HR_GREEN[HIGH]):
-                    self.colorText("green")
-                elif((sensorData[i][VITALS_DATA][HR_DATA] >= HR_AMBER[LOW] and sensorData[i][VITALS_DATA][HR_DATA] < HR_GREEN[LOW]) or \
-                    (sensorData[i][VITALS_DATA][HR_DATA] > HR_GREEN[HIGH] and sensorData[i][VITALS_DATA][HR_DATA] <= HR_AMBER[HIGH])):
-                    self.colorText("yellow")
-                elif((sensorData[i][VITALS_DATA][HR_DATA] >= HR_RED[LOW] and sensorData[i][VITALS_DATA][HR_DATA] < HR_AMBER[LOW]) or \
-                    (sensorData[i][VITALS_DATA][HR_DATA] > HR_AMBER[HIGH] and sensorData[i][VITALS_DATA][HR_DATA] <= HR_RED[HIGH])):
-                    self.colorText("red")
-                elif(sensorData[i][VITALS_DATA][HR_DATA] <= HR_BLACK[LOW] or sensorData[i][VITALS_DATA][HR_DATA] >= HR_BLACK[HIGH]):
-                    self.colorText("blue")
-
-                # Print Data
-                print_at(HR_ROW, DATA_START + (DATA_SPACING * i), str(sensorData[i][VITALS_DATA][HR_DATA]) + "   ") 
-
-            #< SPO2 >#
-            for i in range(WARRIOR_TOTAL):
-                # Determine Color Status
-                if(sensorData[i][VITALS_DATA][SPO2_DATA] > SPO2_AMBER and sensorData[i][VITALS_DATA][SPO2_DATA] <= SPO2_GREEN):
-                    self.colorText("green")
-                elif(sensorData[i][VITALS_DATA][SPO2_DATA] > SPO2_RED and sensorData[i][VITALS_DATA][SPO2_DATA] <= SPO2_AMBER):
-                    self.colorText("yellow")
-                elif(sensorData[i][VITALS_DATA][SPO2_DATA] > SPO2_BLACK and sensorData[i][VITALS_DATA][SPO2_DATA] <= SPO2_RED):
-                    self.colorText("red")
-                elif(sensorData[i][VITALS_DATA][SPO2_DATA] <= SPO2_BLACK):
-                    self.colorText("blue")
-
-                # Print Data
-                print_at(SPO2_ROW, DATA_START + (DATA_SPACING * i), str(sensorData[i][VITALS_DATA][SPO2_DATA]) + "   ")
-
-            #< RESP >#
-            for i in range(WARRIOR_TOTAL):
-                # Determine Color Status
-                if(sensorData[i][VITALS_DATA][RESP_DATA] >= RESP_GREEN[LOW] and sensorData[i][VITALS_DATA][RESP_DATA] <= RESP_GREEN[HIGH]):
-                    self.colorText("green")
-                elif((sensorData[i][VITALS_DATA][RESP_DATA] >= RESP_AMBER[LOW] and sensorData[i][VITALS_DATA][RESP_DATA] < RESP_GREEN[LOW]) or \
-                    (sensorData[i][VITALS_DATA][RESP_DATA] > RESP_GREEN[HIGH] and sensorData[i][VITALS_DATA][RESP_DATA] <= RESP_AMBER[HIGH])):
-                    self.colorText("yellow")
-                elif((sensorData[i][VITALS_DATA][RESP_DATA] >= RESP_RED[LOW] and sensorData[i][VITALS_DATA][RESP_DATA] < RESP_AMBER[LOW]) or \
-                    (sensorData[i][VITALS_DATA][RESP_DATA] > RESP_AMBER[HIGH] and sensorData[i][VITALS_DATA][RESP_DATA] <= RESP_RED[HIGH])):
-                    self.colorText("red")
-                elif(sensorData[i][VITALS_DATA][RESP_DATA] <= RESP_BLACK[LOW] or sensorData[i][VITALS_DATA][RESP_DATA] >= RESP_BLACK[HIGH]):
-                    self.colorText("blue")
-
-                # Print Data
-                print_at(RESP_ROW, DATA_START + (DATA_SPACING * i), str(sensorData[i][VITALS_DATA][RESP_DATA]) + "   ") 
-
-            #< TEMP >#
-            for i in range(WARRIOR_TOTAL):
-                # Determine Color Status
-                if(sensorData[i][VITALS_DATA][TEMP_DATA] >= TEMP_GREEN[LOW] and sensorData[i][VITALS_DATA][TEMP_DATA] <= TEMP_GREEN[HIGH]):
-                    self.colorText("green")
-                elif((sensorData[i][VITALS_DATA][TEMP_DATA] >= TEMP_AMBER[LOW] and sensorData[i][VITALS_DATA][TEMP_DATA] < TEMP_GREEN[LOW]) or \
-                    (sensorData[i][VITALS_DATA][TEMP_DATA] > TEMP_GREEN[HIGH] and sensorData[i][VITALS_DATA][TEMP_DATA] <= TEMP_AMBER[HIGH])):
-                    self.colorText("yellow")
-                elif((sensorData[i][VITALS_DATA][TEMP_DATA] >= TEMP_RED[LOW] and sensorData[i][VITALS_DATA][TEMP_DATA] < TEMP_AMBER[LOW]) or \
-                    (sensorData[i][VITALS_DATA][TEMP_DATA] > TEMP_AMBER[HIGH] and sensorData[i][VITALS_DATA][TEMP_DATA] <= TEMP_RED[HIGH])):
-                    self.colorText("red")
-                elif(sensorData[i][VITALS_DATA][TEMP_DATA] <= TEMP_BLACK[LOW] or sensorData[i][VITALS_DATA][TEMP_DATA] >= TEMP_BLACK[HIGH]):
-                    self.colorText("blue")
-
-                # Print Data
-                print_at(TEMP_ROW, DATA_START + (DATA_SPACING * i), str(sensorData[i][VITALS_DATA][TEMP_DATA]) + "   ") 
-
-            #< WEAPON >#
-            for i in range(WARRIOR_TOTAL):
-                if(sensorData[i][WEAPON_DATA] == WEAPON_GREEN):
-                    self.colorText("green")
-                elif(sensorData[i][WEAPON_DATA] == WEAPON_AMBER):
-                    self.colorText("yellow")
-                elif(sensorData[i][WEAPON_DATA] > WEAPON_RED):
-                    self.colorText("red")
-                elif(sensorData[i][WEAPON_DATA] >= WEAPON_BLACK[LOW] or sensorData[i][WEAPON_DATA] <= WEAPON_BLACK[HIGH]):
-                    self.colorText("blue")
-
-                # Print Data
-                print_at(WEAPON_ROW, DATA_START + (DATA_SPACING * i), str(sensorData[i][WEAPON_DATA]) + "   ") 
+                    self.cellRenderer.drawCell(FIELD_ROWS[field], i, str(value) + "   ",
+                        classify.BAND_COLORS[bands[i][field]])
 
+            # Blank the columns left over on a short last page
+            for i in range(len(values), self.viewport.columns):
+                self.cellRenderer.drawCell(FIELD_ROWS[field], i, "      ", self.dataColor)
 
     def colorText(self, color):
-        # lock the colorText if it is in use by another process
-        while(self.colorText_Mutex.value == 1):
-            pass 
-        
-        # lock mutex
-        self.colorText_Mutex.value = 1
-        if(color == "red"):
-            print(chr(27) + "[31m" + chr(27) + "[033F")
-        elif(color == "green"):
-            print(chr(27) + "[32m" + chr(27) + "[033F")
-        elif(color == "yellow"):
-            print(chr(27) + "[33m" + chr(27) + "[033F")
-        elif(color == "blue"):
-            print(chr(27) + "[34m" + chr(27) + "[033F")
-        elif(color == "magenta"):
-            print(chr(27) + "[35m" + chr(27) + "[033F")
-        elif(color == "cyan"):
-            print(chr(27) + "[36m" + chr(27) + "[033F")
-        elif(color == "white"):
-            print(chr(27) + "[37m" + chr(27) + "[033F")
-        
-        #unlock mutex
-        self.colorText_Mutex.value = 0
+        # Queue a pen color change; draw calls should pass their color to
+        # print_at instead so color and text reach the screen together
+        if(color in COLOR_CODES):
+            terminal.submit(None, None, "", color)
 
     def hideCursor(self):
-        print("\033[?25h")
+        hideCursor()
 
         
 
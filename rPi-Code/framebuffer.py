@@ -0,0 +1,194 @@
+"""
+Title: Augmented Warfighter Awareness System Framebuffer Backend
+Team: UCCS Senior Design "Heads Up" 2020
+
+Purpose: This file draws the display straight into an RGB565 framebuffer
+         instead of sending ANSI escape codes through the console. Text is
+         rendered with an embedded 5x7 font whose glyphs are rasterized
+         once per color, so a text run is a single NumPy copy. The target
+         can be the TFT (/dev/fb1), an ordinary file, or an in-memory
+         buffer for tests and benchmarks.
+
+         display.useBackend(FramebufferWriter("/dev/fb1"))
+
+"""
+import mmap
+import os
+import numpy as np
+import display
+
+### <<< SCREEN >>> ###
+FB_DEVICE               =   "/dev/fb1"      # 2.8" TFT
+FB_WIDTH                =   320
+FB_HEIGHT               =   240
+PIXEL_TYPE              =   np.dtype("<u2") # RGB565
+
+#< TEXT CELLS >#
+# One terminal row / column; the layout needs 53 x 21 cells
+CELL_WIDTH              =   6
+CELL_HEIGHT             =   11
+GLYPH_TOP               =   2               # Rows of padding above each glyph
+
+### <<< COLORS >>> ###
+COLOR_RGB = {
+    "red"       : (255, 0, 0),
+    "green"     : (0, 255, 0),
+    "yellow"    : (255, 255, 0),
+    "blue"      : (64, 96, 255),    # Pure blue is hard to read on black
+    "magenta"   : (255, 0, 255),
+    "cyan"      : (0, 255, 255),
+    "white"     : (255, 255, 255)
+}
+DEFAULT_COLOR           =   "white"
+BACKGROUND_RGB          =   (0, 0, 0)
+
+def rgb565(rgb):
+    (r, g, b) = rgb
+    return ((r >> 3) << 11) | ((g >> 2) << 5) | (b >> 3)
+
+### <<< FONT >>> ###
+# Classic 5x7 LCD font for ASCII 32 - 126: five column bytes per glyph,
+# least significant bit at the top
+FIRST_CHAR              =   32
+FONT_5X7 = bytes([
+    0x00,0x00,0x00,0x00,0x00, 0x00,0x00,0x5F,0x00,0x00, 0x00,0x07,0x00,0x07,0x00, 0x14,0x7F,0x14,0x7F,0x14,  #  !"#
+    0x24,0x2A,0x7F,0x2A,0x12, 0x23,0x13,0x08,0x64,0x62, 0x36,0x49,0x55,0x22,0x50, 0x00,0x05,0x03,0x00,0x00,  # $%&'
+    0x00,0x1C,0x22,0x41,0x00, 0x00,0x41,0x22,0x1C,0x00, 0x08,0x2A,0x1C,0x2A,0x08, 0x08,0x08,0x3E,0x08,0x08,  # ()*+
+    0x00,0x50,0x30,0x00,0x00, 0x08,0x08,0x08,0x08,0x08, 0x00,0x60,0x60,0x00,0x00, 0x20,0x10,0x08,0x04,0x02,  # ,-./
+    0x3E,0x51,0x49,0x45,0x3E, 0x00,0x42,0x7F,0x40,0x00, 0x42,0x61,0x51,0x49,0x46, 0x21,0x41,0x45,0x4B,0x31,  # 0123
+    0x18,0x14,0x12,0x7F,0x10, 0x27,0x45,0x45,0x45,0x39, 0x3C,0x4A,0x49,0x49,0x30, 0x01,0x71,0x09,0x05,0x03,  # 4567
+    0x36,0x49,0x49,0x49,0x36, 0x06,0x49,0x49,0x29,0x1E, 0x00,0x36,0x36,0x00,0x00, 0x00,0x56,0x36,0x00,0x00,  # 89:;
+    0x08,0x14,0x22,0x41,0x00, 0x14,0x14,0x14,0x14,0x14, 0x00,0x41,0x22,0x14,0x08, 0x02,0x01,0x51,0x09,0x06,  # <=>?
+    0x32,0x49,0x79,0x41,0x3E, 0x7E,0x11,0x11,0x11,0x7E, 0x7F,0x49,0x49,0x49,0x36, 0x3E,0x41,0x41,0x41,0x22,  # @ABC
+    0x7F,0x41,0x41,0x22,0x1C, 0x7F,0x49,0x49,0x49,0x41, 0x7F,0x09,0x09,0x09,0x01, 0x3E,0x41,0x49,0x49,0x7A,  # DEFG
+    0x7F,0x08,0x08,0x08,0x7F, 0x00,0x41,0x7F,0x41,0x00, 0x20,0x40,0x41,0x3F,0x01, 0x7F,0x08,0x14,0x22,0x41,  # HIJK
+    0x7F,0x40,0x40,0x40,0x40, 0x7F,0x02,0x0C,0x02,0x7F, 0x7F,0x04,0x08,0x10,0x7F, 0x3E,0x41,0x41,0x41,0x3E,  # LMNO
+    0x7F,0x09,0x09,0x09,0x06, 0x3E,0x41,0x51,0x21,0x5E, 0x7F,0x09,0x19,0x29,0x46, 0x46,0x49,0x49,0x49,0x31,  # PQRS
+    0x01,0x01,0x7F,0x01,0x01, 0x3F,0x40,0x40,0x40,0x3F, 0x1F,0x20,0x40,0x20,0x1F, 0x3F,0x40,0x38,0x40,0x3F,  # TUVW
+    0x63,0x14,0x08,0x14,0x63, 0x07,0x08,0x70,0x08,0x07, 0x61,0x51,0x49,0x45,0x43, 0x00,0x7F,0x41,0x41,0x00,  # XYZ[
+    0x02,0x04,0x08,0x10,0x20, 0x00,0x41,0x41,0x7F,0x00, 0x04,0x02,0x01,0x02,0x04, 0x40,0x40,0x40,0x40,0x40,  # \\]^_
+    0x00,0x01,0x02,0x04,0x00, 0x20,0x54,0x54,0x54,0x78, 0x7F,0x48,0x44,0x44,0x38, 0x38,0x44,0x44,0x44,0x20,  # `abc
+    0x38,0x44,0x44,0x48,0x7F, 0x38,0x54,0x54,0x54,0x18, 0x08,0x7E,0x09,0x01,0x02, 0x0C,0x52,0x52,0x52,0x3E,  # defg
+    0x7F,0x08,0x04,0x04,0x78, 0x00,0x44,0x7D,0x40,0x00, 0x20,0x40,0x44,0x3D,0x00, 0x7F,0x10,0x28,0x44,0x00,  # hijk
+    0x00,0x41,0x7F,0x40,0x00, 0x7C,0x04,0x18,0x04,0x78, 0x7C,0x08,0x04,0x04,0x78, 0x38,0x44,0x44,0x44,0x38,  # lmno
+    0x7C,0x14,0x14,0x14,0x08, 0x08,0x14,0x14,0x18,0x7C, 0x7C,0x08,0x04,0x04,0x08, 0x48,0x54,0x54,0x54,0x20,  # pqrs
+    0x04,0x3F,0x44,0x40,0x20, 0x3C,0x40,0x40,0x20,0x7C, 0x1C,0x20,0x40,0x20,0x1C, 0x3C,0x40,0x30,0x40,0x3C,  # tuvw
+    0x44,0x28,0x10,0x28,0x44, 0x0C,0x50,0x50,0x50,0x3C, 0x44,0x64,0x54,0x4C,0x44, 0x00,0x08,0x36,0x41,0x00,  # xyz{
+    0x00,0x00,0x7F,0x00,0x00, 0x00,0x41,0x36,0x08,0x00, 0x08,0x04,0x08,0x10,0x08                              # |}~
+])
+GLYPH_COUNT             =   len(FONT_5X7) // 5
+UNKNOWN_GLYPH           =   ord("?") - FIRST_CHAR
+
+def rasterizeFont():
+    # (GLYPH_COUNT, CELL_HEIGHT, CELL_WIDTH) booleans, True where the pen draws
+    columns = np.frombuffer(FONT_5X7, dtype=np.uint8).reshape(GLYPH_COUNT, 5)
+    bits = (columns[:, None, :] >> np.arange(7, dtype=np.uint8)[None, :, None]) & 1
+    masks = np.zeros((GLYPH_COUNT, CELL_HEIGHT, CELL_WIDTH), dtype=bool)
+    masks[:, GLYPH_TOP : GLYPH_TOP + 7, :5] = bits.astype(bool)
+    return masks
+
+class GlyphCache(object):
+    """ Every glyph pre-rendered as RGB565 pixels, built once per color the
+        first time it is used. """
+
+    def __init__(self, background=BACKGROUND_RGB):
+        self.masks = rasterizeFont()
+        self.background = rgb565(background)
+        self.colored = {}
+
+        # Byte value -> glyph index, with anything unprintable shown as "?"
+        self.lookup = np.full(256, UNKNOWN_GLYPH, dtype=np.intp)
+        self.lookup[FIRST_CHAR : FIRST_CHAR + GLYPH_COUNT] = np.arange(GLYPH_COUNT)
+
+    def glyphs(self, color):
+        if(color not in self.colored):
+            foreground = rgb565(COLOR_RGB.get(color, COLOR_RGB[DEFAULT_COLOR]))
+            self.colored[color] = np.where(self.masks, foreground, self.background).astype(PIXEL_TYPE)
+        return self.colored[color]
+
+    def render(self, text, color):
+        # (CELL_HEIGHT, len(text) * CELL_WIDTH) pixels for a run of text
+        index = self.lookup[np.frombuffer(text.encode("latin-1", "replace"), dtype=np.uint8)]
+        cells = self.glyphs(color)[index]
+        return cells.transpose(1, 0, 2).reshape(CELL_HEIGHT, len(text) * CELL_WIDTH)
+
+### <<< TARGETS >>> ###
+def openTarget(target, width=FB_WIDTH, height=FB_HEIGHT):
+    # -> (backing buffer, (height, width) pixel array over it)
+    #   None: in-memory bytearray; "/dev/fb*": the device; anything else: a file
+    if(target is None):
+        buffer = bytearray(width * height * PIXEL_TYPE.itemsize)
+        stride = width
+    elif(os.path.basename(target).startswith("fb") and target.startswith("/dev/")):
+        # Geometry comes from the driver, which may pad each line
+        sysfs = "/sys/class/graphics/" + os.path.basename(target) + "/"
+        (width, height) = [int(value) for value in open(sysfs + "virtual_size").read().split(",")]
+        stride = int(open(sysfs + "stride").read()) // PIXEL_TYPE.itemsize
+        fd = os.open(target, os.O_RDWR)
+        buffer = mmap.mmap(fd, stride * height * PIXEL_TYPE.itemsize)
+        os.close(fd)
+    else:
+        size = width * height * PIXEL_TYPE.itemsize
+        fd = os.open(target, os.O_RDWR | os.O_CREAT, 0o644)
+        if(os.fstat(fd).st_size < size):
+            os.ftruncate(fd, size)
+        buffer = mmap.mmap(fd, size)
+        os.close(fd)
+        stride = width
+
+    pixels = np.frombuffer(buffer, dtype=PIXEL_TYPE, count=stride * height).reshape(height, stride)[:, :width]
+    return (buffer, pixels)
+
+### <<< BACKEND >>> ###
+class FramebufferWriter(display.TerminalWriter):
+    """ Drop-in replacement for display.TerminalWriter: same queue, writer
+        thread and counters, but each frame's ops are drawn as pixels.
+        Terminal cell (row, col) maps to a CELL_WIDTH x CELL_HEIGHT block;
+        anything off screen is clipped. bytesWritten counts pixel bytes. """
+
+    usesStdout = False
+
+    def __init__(self, target=None, width=FB_WIDTH, height=FB_HEIGHT, maxQueue=display.WRITER_QUEUE_SIZE):
+        display.TerminalWriter.__init__(self, maxQueue)
+        (self.buffer, self.pixels) = openTarget(target, width, height)
+        self.glyphCache = GlyphCache()
+        self.background = self.glyphCache.background
+
+    def writeFrames(self, frames):
+        size = 0
+        for frame in frames:
+            for (row, col, text, color) in frame.ops:
+                if(row is None):
+                    size += self.escape(text)
+                elif(text):
+                    size += self.drawText(row, col, text, color)
+        self.writesIssued += 1
+        return size
+
+    def escape(self, sequence):
+        # Of the raw sequences only clearing the screen means anything here
+        if(sequence == display.CLEAR_SCREEN):
+            self.pixels[:] = self.background
+            return self.pixels.nbytes
+        return 0
+
+    def drawText(self, row, col, text, color):
+        (height, width) = self.pixels.shape
+        x = (col - 1) * CELL_WIDTH
+        y = (row - 1) * CELL_HEIGHT
+        if(x < 0 or y < 0 or y + CELL_HEIGHT > height):
+            return 0
+
+        text = text[:(width - x) // CELL_WIDTH]
+        if(not text):
+            return 0
+
+        run = self.glyphCache.render(text, color or DEFAULT_COLOR)
+        self.pixels[y : y + CELL_HEIGHT, x : x + run.shape[1]] = run
+        return run.nbytes
+
+    def image(self):
+        # (height, width, 3) RGB888 copy of the screen, e.g. for a screenshot
+        pixels = self.pixels.astype(np.uint32)
+        rgb = np.stack([(pixels >> 11) & 0x1F, (pixels >> 5) & 0x3F, pixels & 0x1F], axis=-1)
+        return (rgb * [255 / 31, 255 / 63, 255 / 31]).astype(np.uint8)
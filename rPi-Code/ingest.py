@@ -0,0 +1,222 @@
+"""
+Title: Augmented Warfighter Awareness System Sensor Ingest
+Team: UCCS Senior Design "Heads Up" 2020
+
+Purpose: This file accepts batched readings pushed by body-worn sensor
+         nodes, over UDP datagrams or TCP frames (protocol.py INGEST_*).
+         Batches are validated and merged into a pending copy of the squad
+         state with NumPy, and the pending state is committed to the
+         SensorStore on a fixed interval. However many readings arrive, the
+         display and server see at most one new sample per interval.
+
+"""
+import selectors
+import socket
+from threading import Lock, Thread
+import time
+import numpy as np
+import classify
+import protocol
+import stats
+
+### <<< LISTENER >>> ###
+INGEST_HOST             =   "0.0.0.0"
+INGEST_PORT             =   9503            # Same port for UDP and TCP
+UDP_BUFFER_SIZE         =   1 << 20         # Kernel receive buffer to ride out bursts
+MAX_DATAGRAM            =   65535
+TCP_RECV_SIZE           =   65536
+
+### <<< COMMIT >>> ###
+COMMIT_INTERVAL         =   0.1             # Seconds between appends to the store
+
+class Ingestor(object):
+    """ Merges ingest batches into the live squad state.
+
+        submit() can be called from any thread: it validates a batch and
+        writes its measured fields into pending (last reading wins). The
+        commit thread appends pending to the store every COMMIT_INTERVAL
+        if anything changed, which notifies the display and the server
+        through the store's listeners. """
+
+    def __init__(self, sensorStore, commitInterval=COMMIT_INTERVAL):
+        self.sensorStore = sensorStore
+        self.commitInterval = commitInterval
+
+        # Warrior ID -> store row, as a sorted table for np.searchsorted
+        order = np.argsort(sensorStore.ids)
+        self.sortedIds = sensorStore.ids[order]
+        self.sortedRows = order
+
+        # Warriors whose nodes have not reported stay NaN (no reading), not 0
+        self.pendingLock = Lock()
+        self.pending = np.array(sensorStore.latest(), dtype=np.float64)
+        self.pendingReadings = 0
+        self.thread = None
+
+        self.batchTime = stats.registry.histogram("ingest.batch")
+        self.commitTime = stats.registry.histogram("ingest.commit")
+        self.batches = stats.registry.counter("ingest.batches")
+        self.readings = stats.registry.counter("ingest.readings")
+        self.badBatches = stats.registry.counter("ingest.badBatches")
+        self.droppedRecords = stats.registry.counter("ingest.droppedRecords")
+        self.coalesced = stats.registry.counter("ingest.coalesced")
+        self.commits = stats.registry.counter("ingest.commits")
+        stats.registry.gauge("ingest.backlog", lambda: self.pendingReadings)
+
+    def rowsFor(self, ids):
+        # Store rows for the given IDs, -1 where the ID is unknown
+        index = np.minimum(np.searchsorted(self.sortedIds, ids), len(self.sortedIds) - 1)
+        known = self.sortedIds[index] == ids
+        return np.where(known, self.sortedRows[index], -1)
+
+    def submit(self, batch):
+        # One ingest batch (header + records); returns records accepted
+        start = stats.now()
+        header = protocol.INGEST_HEADER
+        if(len(batch) < header.size):
+            self.badBatches.add()
+            return 0
+
+        (magic, count, nodeSequence) = header.unpack_from(batch)
+        if(magic != protocol.INGEST_MAGIC or len(batch) != header.size + count * protocol.INGEST_DTYPE.itemsize):
+            self.badBatches.add()
+            return 0
+
+        records = np.frombuffer(batch, dtype=protocol.INGEST_DTYPE, count=count, offset=header.size)
+        rows = self.rowsFor(records["id"])
+
+        # Unknown warriors, nothing measured, or unreadable floats are dropped
+        valid = (rows >= 0) & ((records["mask"] & protocol.INGEST_ALL_FIELDS) != 0) & \
+            np.isfinite(records["water"]) & np.isfinite(records["temp"])
+        self.droppedRecords.add(count - int(np.count_nonzero(valid)))
+        records = records[valid]
+        rows = rows[valid]
+
+        accepted = 0
+        with self.pendingLock:
+            for (field, name) in enumerate(classify.FIELD_NAMES):
+                measured = (records["mask"] & (1 << field)) != 0
+                # For a warrior repeated in a batch the later record wins
+                self.pending[rows[measured], field] = records[name][measured]
+                accepted += int(np.count_nonzero(measured))
+
+            if(self.pendingReadings):
+                self.coalesced.add(min(accepted, self.pendingReadings))
+            self.pendingReadings += accepted
+
+        self.batches.add()
+        self.readings.add(accepted)
+        self.batchTime.recordSince(start)
+        return len(records)
+
+    def commit(self):
+        with self.pendingLock:
+            if(not self.pendingReadings):
+                return False
+            values = self.pending.copy()
+            self.pendingReadings = 0
+
+        start = stats.now()
+        self.sensorStore.append(values)
+        self.commits.add()
+        self.commitTime.recordSince(start)
+        return True
+
+    def start(self):
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        # Commit on a fixed cadence regardless of how bursty the input is
+        nextCommit = time.monotonic()
+        while(1):
+            nextCommit += self.commitInterval
+            self.commit()
+
+            delay = nextCommit - time.monotonic()
+            if(delay > 0):
+                time.sleep(delay)
+            else:
+                nextCommit = time.monotonic()
+
+class IngestListener(object):
+    """ UDP and TCP ingest on one port, served by a single selector thread
+        so any number of nodes costs no extra threads. A UDP datagram is one
+        batch; a TCP connection carries FRAME_INGEST frames. """
+
+    def __init__(self, ingestor, host=INGEST_HOST, port=INGEST_PORT):
+        self.ingestor = ingestor
+        self.selector = selectors.DefaultSelector()
+        self.decoders = {}
+        self.buffer = bytearray(MAX_DATAGRAM)
+
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_BUFFER_SIZE)
+        self.udp.bind((host, port))
+        self.udp.setblocking(False)
+        self.port = self.udp.getsockname()[1]
+
+        self.tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.tcp.bind((host, self.port))
+        self.tcp.listen(socket.SOMAXCONN)
+        self.tcp.setblocking(False)
+
+        self.selector.register(self.udp, selectors.EVENT_READ, self.readDatagrams)
+        self.selector.register(self.tcp, selectors.EVENT_READ, self.accept)
+
+        self.badFrames = stats.registry.counter("ingest.badFrames")
+        stats.registry.gauge("ingest.nodesConnected", lambda: len(self.decoders))
+
+    def start(self):
+        self.ingestor.start()
+        Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while(1):
+            for (key, events) in self.selector.select():
+                key.data(key.fileobj)
+
+    def readDatagrams(self, sock):
+        # Drain everything queued, not just one datagram per wakeup
+        while(1):
+            try:
+                size = sock.recv_into(self.buffer)
+            except (BlockingIOError, InterruptedError):
+                return
+            self.ingestor.submit(bytes(self.buffer[:size]))
+
+    def accept(self, sock):
+        try:
+            (connection, address) = sock.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        connection.setblocking(False)
+        self.decoders[connection] = protocol.FrameDecoder()
+        self.selector.register(connection, selectors.EVENT_READ, self.readStream)
+
+    def readStream(self, connection):
+        try:
+            data = connection.recv(TCP_RECV_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+
+        try:
+            frames = self.decoders[connection].feed(data) if data else None
+        except ValueError: #< Oversized frame; the stream can't be trusted
+            self.badFrames.add()
+            frames = None
+
+        if(frames is None):
+            self.selector.unregister(connection)
+            del self.decoders[connection]
+            connection.close()
+            return
+
+        for (frameType, payload) in frames:
+            if(frameType == protocol.FRAME_INGEST):
+                self.ingestor.submit(payload)
+            else:
+                self.badFrames.add()
@@ -0,0 +1,173 @@
+"""
+Title: Augmented Warfighter Awareness System Load Generator
+Team: UCCS Senior Design "Heads Up" 2020
+
+Purpose: This file simulates a squad of any size (thousands of warriors if
+         need be) so the display and server can be exercised under load.
+         Each sensor reports at its own rate, and the readings drift the way
+         a patrol would: water drains, HR climbs and SpO2 falls on the
+         wounded, and bursts of fire spend ammo and reset the weapon timer.
+         Samples go into a SensorStore exactly like real sensor data.
+
+"""
+import time
+import numpy as np
+import display
+import classify
+
+### <<< SQUAD >>> ###
+LOAD_WARRIORS           =   1000
+FIRST_ID                =   1
+TICK_RATE               =   10.0    # Store appends per second
+
+#< SENSOR REPORT RATES >#
+# Reports per second, in classify.FIELD_* order; a reading holds in between
+SENSOR_RATES            =   [10.0, 0.1, 1.0, 1.0, 0.2, 0.5, 10.0]
+
+### <<< DRIFT >>> ###
+#< BASELINES >#
+HR_BASELINE             =   [80, 8]         # Beats per minute [mean, spread]
+SPO2_BASELINE           =   [98, 1]
+TEMP_BASELINE           =   [98.6, 0.4]
+RESP_BASELINE           =   [14, 1.5]
+AMMO_LOAD               =   [150, 300]      # Rounds carried [min, max]
+WATER_LOAD              =   [2.0, 3.0]      # Liters carried [min, max]
+
+#< RATES >#
+WATER_DRAIN             =   0.5 / 3600      # Liters per second
+WANDER                  =   0.1             # Pull back toward the baseline per second
+WOUND_RATE              =   1.0 / 7200      # Chance per second a warrior is hit
+BLEED_RATE              =   1.0 / 300       # Severity gained per second once hit
+
+# Vital drift at full severity (a warrior in hemorrhagic shock)
+WOUND_HR                =   90
+WOUND_SPO2              =   -25
+WOUND_TEMP              =   -8
+WOUND_RESP              =   14
+
+#< FIRING >#
+ENGAGE_RATE             =   1.0 / 600       # Chance per second a burst starts
+BURST_ROUNDS            =   [3, 30]         # Rounds per burst [min, max]
+FIRE_RATE               =   8.0             # Rounds per second while firing
+SAFE_DELAY              =   5.0             # Seconds after a burst before going back to safe
+WEAPON_HOLD             =   600             # Weapon timer stops counting here
+
+class SensorLoadGenerator(object):
+    """ Vectorized squad simulation.
+
+        truth holds the actual state of every warrior, advanced by step();
+        sample() hands back what the sensors last reported, each field
+        refreshed only when its SENSOR_RATES period comes due (phases are
+        staggered per warrior). Everything comes from one seeded generator,
+        so the same seed gives the same run. """
+
+    def __init__(self, warriors=LOAD_WARRIORS, seed=None, rates=SENSOR_RATES, firstId=FIRST_ID):
+        self.rng = np.random.default_rng(seed)
+        self.ids = np.arange(firstId, firstId + warriors)
+        self.periods = 1.0 / np.array(rates, dtype=np.float64)
+        self.clock = 0.0
+
+        rng = self.rng
+        self.baseline = np.zeros((warriors, classify.FIELD_TOTAL))
+        self.baseline[:, classify.FIELD_HR] = rng.normal(*HR_BASELINE, warriors)
+        self.baseline[:, classify.FIELD_SPO2] = np.minimum(rng.normal(*SPO2_BASELINE, warriors), 100)
+        self.baseline[:, classify.FIELD_TEMP] = rng.normal(*TEMP_BASELINE, warriors)
+        self.baseline[:, classify.FIELD_RESP] = rng.normal(*RESP_BASELINE, warriors)
+
+        self.truth = self.baseline.copy()
+        self.truth[:, classify.FIELD_AMMO] = rng.integers(AMMO_LOAD[0], AMMO_LOAD[1] + 1, warriors)
+        self.truth[:, classify.FIELD_WATER] = rng.uniform(*WATER_LOAD, warriors)
+        self.truth[:, classify.FIELD_WEAPON] = display.WEAPON_GREEN
+
+        # 0 = unhurt, 1 = full shock
+        self.severity = np.zeros(warriors)
+
+        # Rounds left in the current burst, and seconds since the last round
+        self.burst = np.zeros(warriors)
+        self.sinceFired = np.full(warriors, np.inf)
+
+        self.reported = self.truth.copy()
+        self.nextReport = rng.uniform(0, 1, (warriors, classify.FIELD_TOTAL)) * self.periods
+
+    def __len__(self):
+        return len(self.ids)
+
+    def step(self, dt):
+        rng = self.rng
+        warriors = len(self.ids)
+        truth = self.truth
+        self.clock += dt
+
+        # Wounds start at random and get worse until the end of the run
+        hit = rng.random(warriors) < WOUND_RATE * dt
+        self.severity[hit] = np.maximum(self.severity[hit], 0.05)
+        bleeding = self.severity > 0
+        self.severity[bleeding] = np.minimum(self.severity[bleeding] + BLEED_RATE * dt, 1.0)
+
+        # Vitals wander around a target that moves with the wound severity
+        target = self.baseline.copy()
+        target[:, classify.FIELD_HR] += WOUND_HR * self.severity
+        target[:, classify.FIELD_SPO2] += WOUND_SPO2 * self.severity
+        target[:, classify.FIELD_TEMP] += WOUND_TEMP * self.severity
+        target[:, classify.FIELD_RESP] += WOUND_RESP * self.severity
+
+        vitals = [classify.FIELD_HR, classify.FIELD_SPO2, classify.FIELD_TEMP, classify.FIELD_RESP]
+        spread = np.array([HR_BASELINE[1], SPO2_BASELINE[1], TEMP_BASELINE[1], RESP_BASELINE[1]])
+        pull = min(WANDER * dt, 1.0)
+        truth[:, vitals] += (target[:, vitals] - truth[:, vitals]) * pull + \
+            rng.normal(0, 1, (warriors, len(vitals))) * spread * np.sqrt(pull)
+        truth[:, classify.FIELD_SPO2] = np.minimum(truth[:, classify.FIELD_SPO2], 100)
+
+        truth[:, classify.FIELD_WATER] = np.maximum(truth[:, classify.FIELD_WATER] - WATER_DRAIN * dt, 0)
+
+        # Bursts of fire spend ammo and reset the weapon timer
+        engage = (self.burst == 0) & (rng.random(warriors) < ENGAGE_RATE * dt)
+        self.burst[engage] = rng.integers(BURST_ROUNDS[0], BURST_ROUNDS[1] + 1, np.count_nonzero(engage))
+
+        ammo = truth[:, classify.FIELD_AMMO]
+        rounds = np.minimum(np.minimum(self.burst, FIRE_RATE * dt), ammo)
+        firing = rounds > 0
+        ammo -= rounds
+        self.burst[firing] -= rounds[firing]
+        self.burst[ammo <= 0] = 0
+
+        self.sinceFired[firing] = 0
+        self.sinceFired[~firing] += dt
+
+        # Weapon value: seconds since firing, odd while on fire, even on safe
+        fired = np.isfinite(self.sinceFired)
+        onFire = (self.burst > 0) | (self.sinceFired < SAFE_DELAY)
+        seconds = np.minimum(self.sinceFired[fired], WEAPON_HOLD)
+        weapon = np.where(onFire, display.WEAPON_AMBER, display.WEAPON_GREEN).astype(np.float64)
+        weapon[fired] = 2 + 2 * (seconds // 2) + weapon[fired]
+        truth[:, classify.FIELD_WEAPON] = weapon
+
+    def sample(self):
+        # (warriors, FIELD_TOTAL) readings as last reported by each sensor
+        due = self.nextReport <= self.clock
+        self.reported[due] = self.truth[due]
+        self.nextReport = np.where(due, np.maximum(self.nextReport + self.periods, self.clock), self.nextReport)
+
+        readings = self.reported.copy()
+        integral = [classify.FIELD_AMMO, classify.FIELD_HR, classify.FIELD_SPO2, classify.FIELD_RESP, classify.FIELD_WEAPON]
+        readings[:, integral] = np.round(readings[:, integral])
+        readings[:, classify.FIELD_WATER] = np.round(readings[:, classify.FIELD_WATER], 1)
+        readings[:, classify.FIELD_TEMP] = np.round(readings[:, classify.FIELD_TEMP], 1)
+        return readings
+
+    def run(self, sensorStore, tickRate=TICK_RATE, duration=None, realtime=True, stop=None):
+        # Append a sample every 1 / tickRate simulated seconds. With realtime
+        # off nothing sleeps, which drives the store as fast as it will go.
+        # Runs until `duration` simulated seconds or the stop Event is set.
+        dt = 1.0 / tickRate
+        start = time.time()
+        end = None if duration is None else self.clock + duration
+
+        while((end is None or self.clock < end) and (stop is None or not stop.is_set())):
+            self.step(dt)
+            sensorStore.append(self.sample(), start + self.clock)
+
+            if(realtime):
+                delay = start + self.clock - time.time()
+                if(delay > 0):
+                    time.sleep(delay)
@@ -13,8 +13,22 @@ Purpose: This file is intended to run a Raspberry Pi 4 (or other submodels),
 import socket
 from threading import Thread
 from multiprocessing import Value
+import multiprocessing
+import atexit
+import signal
 import display
 from display import MessagePrintService, ConnectionStatus
+from server import AsyncServerHost, POLICY_DROP, POLICY_DISCONNECT
+from sensorstore import SensorStore
+from classify import flattenSensorData, BAND_RED
+from loadgen import SensorLoadGenerator
+from multicast import MulticastPublisher
+from ingest import Ingestor, IngestListener
+from recorder import FlightRecorder, LogReader, Replayer
+from alerts import AlertEngine
+from framebuffer import FramebufferWriter
+from sharedstate import SharedSensorStore, MessageForwarder, receiveMessages, forwardStats, receiveStats, \
+    MAX_MESSAGES, MAX_STATS_REPORTS
 import time
 import subprocess
 import platform
@@ -25,11 +39,58 @@ DEMO = 1
 
 RUNMODE = RUN
 
+# Where the sensor readings come from
+DEMO_DATA = 0   # The three demo samples below, on a loop
+LOAD_DATA = 1   # Simulated squad from loadgen.py
+INGEST_DATA = 2 # Readings pushed by sensor nodes to ingest.py (squad IDs from ID)
+REPLAY_DATA = 3 # A flight recorder log played back (see recorder.py)
+
+DATA_SOURCE = DEMO_DATA
+LOAD_WARRIORS = 1000
+LOAD_SEED = 2020        # None for a different squad every run
+
+# Also send every snapshot once to a UDP multicast group (see multicast.py)
+MULTICAST_ENABLED = False
+
+# Band change alerts for clients that send "Alerts on"; those into or out
+# of this band or worse are also shown in the message pane
+ALERTS_ENABLED = True
+ALERT_PANE_BAND = BAND_RED
+
+# Flight recorder log of every snapshot and client command (None to disable)
+RECORD_PATH = None      # e.g. "awas-record.log"; never the log being replayed
+
+# Log to play back with DATA_SOURCE = REPLAY_DATA
+REPLAY_PATH = "awas.log"
+REPLAY_SPEED = 1.0      # Multiple of real time; 0 as fast as possible
+REPLAY_START = None     # Timestamp to start from, None for the beginning
+
+# Where the display is drawn
+ANSI_DISPLAY = 0        # Escape codes to the console on the TFT
+FRAMEBUFFER_DISPLAY = 1 # Pixels straight into the TFT framebuffer (see framebuffer.py)
+
+DISPLAY_BACKEND = ANSI_DISPLAY
+FRAMEBUFFER_TARGET = "/dev/fb1"
+
+# How the work is split up
+THREAD_PIPELINE = 0     # Everything on threads in this process
+PROCESS_PIPELINE = 1    # Ingest here, render and network in processes of their own,
+                        # sharing the squad state in shared memory (see sharedstate.py).
+                        # RECORD_PATH then records snapshots but not client commands.
+
+PIPELINE = THREAD_PIPELINE
+
+# A client that can't keep up loses queued snapshot pushes (POLICY_DROP)
+# or, with this set, its connection (POLICY_DISCONNECT); see server.py
+DISCONNECT_SLOW_CLIENTS = False
+SLOW_CONSUMER_POLICY = POLICY_DISCONNECT if DISCONNECT_SLOW_CLIENTS else POLICY_DROP
+
 HOST = "10.0.0.204"
 PORT = "9501"
 
 # Demo Sensor Data
 SAMPLES = 3
+SAMPLE_PERIOD = 2.0     # Seconds between demo samples
 
 ID = [1, 2, 3]
 # ammo_count = [265, 200, 20]
@@ -106,94 +167,148 @@ sensorData_packages =\
     ]\
 ]
 
-def ServerHost():
-    exit = 0
+# Live squad state (with recent history) read by the display and the server
+if(DATA_SOURCE == LOAD_DATA):
+    loadGenerator = SensorLoadGenerator(LOAD_WARRIORS, LOAD_SEED)
+    sensorStore = SensorStore(loadGenerator.ids)
+elif(DATA_SOURCE == REPLAY_DATA):
+    logReader = LogReader(REPLAY_PATH)
+    sensorStore = SensorStore(logReader.ids)
+else:
+    sensorStore = SensorStore(ID)
+
+def DemoFeed():
+    # Feed the demo samples into the store as if they were live readings
+    while(1):
+        for sample in sensorData_packages:
+            sensorStore.append(flattenSensorData(sample))
+            time.sleep(SAMPLE_PERIOD)
+
+def LoadFeed():
+    # Feed the simulated squad into the store in real time
+    loadGenerator.run(sensorStore)
+
+def ReplayFeed():
+    # Play the recorded log into the store, then leave the last sample up
+    Replayer(logReader, sensorStore, messagePrintService, REPLAY_SPEED).run(REPLAY_START)
+    messagePrintService.printClientMessage("Replay finished")
+
+def AlertPane(events):
+    # Only the serious band changes, so the pane is not flooded
+    for event in events:
+        if(max(event.oldBand, event.newBand) >= ALERT_PANE_BAND):
+            messagePrintService.printClientMessage("Alert " + str(event))
 
-    # Blocking statement to wait for a connection
-    time.sleep(2)
-    messagePrintService.printClientMessage("Waiting for connection")
-    
-    # accept connection
-    (clientsocket, address) = serversocket.accept()
+def ServerHost():
+    # Serve every HoloLens client from one asyncio event loop on this thread
     time.sleep(2)
+    messagePrintService.printClientMessage("Waiting for connections")
 
-    # Reply to connection
-    messagePrintService.printClientMessage("Connection Success with {}:{}".format(str(address[0]), str(address[1])))
-    clientsocket.send("Welcome to the Augmented Warfighter Awareness System\r\n".encode("utf-8"))
-    clientsocket.send("Connection from {}:{} to {}:{}".format(str(address[0]), str(address[1]), HOST, PORT).encode("utf-8"))
-
-    while not exit:
-
-        try:    
-            # Display valid commands to client
-            clientsocket.send("\r\n\r\nValid Commands: \r\nPing\r\nPoll\r\nShutdown\r\nCommand: ".encode())
-            
-            # Receive and decode clients message
-            data = clientsocket.recv(1024).decode("utf-8")
-
-        except BrokenPipeError as e: #< Unexpected disconnection
-            # Print exception
-            messagePrintService.printClientMessage(str(e))
-            messagePrintService.printClientMessage("Attempting to reconnect")
-            
-            # Attempt to reconnect
-            serversocket.listen(requestAttempts)
-            (clientsocket, address) = serversocket.accept()
-
-            # Did we find a client?
-            if(clientsocket is not None and address is not None):
-                messagePrintService.printClientMessage("Reconnection Success with " + str(address))
-                clientsocket.send("Welcome to the Augmented Warfighter Awareness System\r\n".encode("utf-8"))
-            
-                # Display valid commands to client
-                clientsocket.send("\r\n\r\nValid Commands: \r\nPing\r\nPoll\r\nShutdown\r\nCommand: ".encode())
-                
-                # Receive and decode clients message
-                data = clientsocket.recv(1024).decode("utf-8")
-
-            else:
-                messagePrintService.printClientMessage("Client disconnected")
-                exit = 1
-            
-        if(data is not None):
-
-            if data == "Ping" or data == 'ping':
-                # Acknowledge command
-                messagePrintService.printClientMessage("Ping request from " + str(address[0]))
-                
-                # Send a response to client
-                clientsocket.send("\n{}: ".format(HOST).encode())
-                clientsocket.send("Pong\r\n".encode())
-
-            elif data == "Poll" or data == 'poll':
-                # Acknowledge command
-                messagePrintService.printClientMessage("Poll request from " + str(address[0]))
-
-                # Send a response to client
-                clientsocket.send("\n{}: ".format(HOST).encode())
-                for i in range(3):
-                    clientsocket.send(str(sensorData_packages[messagePrintService.sample_counter][i]).encode() + "\r\n".encode())
-
-            elif data == "Shutdown" or data == 'shutdown':
-                # Acknowledge command
-                messagePrintService.printClientMessage("Shutdown commanded from " + str(address))
-                exit = 1
-
-    clientsocket.close()
+    serverHost = AsyncServerHost(messagePrintService, sensorStore, HOST, PORT, flightRecorder, alertEngine,
+                                 SLOW_CONSUMER_POLICY)
+    serverHost.serve(serversocket)
     return
 
+def StartServerHost():
+    # On a thread here, or in the network process
+    if(PIPELINE == PROCESS_PIPELINE):
+        serverProcess = processContext.Process(target=NetworkProcess,
+                                               args=(sensorStore.name, messageQueue, statsQueue, serversocket))
+        serverProcess.start()
+        return serverProcess
+
+    serverThread = Thread(target=ServerHost)
+    serverThread.start()
+    return serverThread
+
+def Terminate(signum, frame):
+    # SIGTERM: unwind the main thread through its normal shutdown
+    raise SystemExit(128 + signum)
+
+def RenderProcess(storeName, messageQueue, statsQueue):
+    # The display alone; squad state from shared memory, messages from the queue
+    global messagePrintService
+    if(DISPLAY_BACKEND == FRAMEBUFFER_DISPLAY):
+        display.useBackend(FramebufferWriter(FRAMEBUFFER_TARGET))
+    display.clearScreen()
+    display.hideCursor()
+
+    messagePrintService = MessagePrintService()
+    messagePrintService.displayStructure()
+    receiveMessages(messageQueue, messagePrintService)
+    forwardStats(statsQueue, "render")
+
+    sharedStore = SharedSensorStore(name=storeName)
+    sharedStore.follow()
+    messagePrintService.displayData(ConnectionStatus(), sharedStore)
+
+def NetworkProcess(storeName, messageQueue, statsQueue, listeningSocket):
+    # The server and the alerts it pushes, reading the shared squad state
+    global messagePrintService, sensorStore, serversocket, flightRecorder, alertEngine
+    messagePrintService = MessageForwarder(messageQueue)
+    sensorStore = SharedSensorStore(name=storeName)
+    serversocket = listeningSocket
+    flightRecorder = None
+    receiveStats(statsQueue)
+
+    alertEngine = None
+    if(ALERTS_ENABLED):
+        alertEngine = AlertEngine(sensorStore)
+        alertEngine.addListener(AlertPane)
+        alertEngine.start()
+
+    sensorStore.follow()
+    ServerHost()
+
 if __name__ == '__main__':
 
     if(RUNMODE == RUN):
-        # Setup Display
-        display.clearScreen()
-        display.hideCursor()
-
-        # Turn on message print service
-        messagePrintService = MessagePrintService()
-
-        # Display AWAS Structure
-        messagePrintService.displayStructure()
+        if(PIPELINE == PROCESS_PIPELINE):
+            # This process ingests; the display and server attach to the shared store
+            processContext = multiprocessing.get_context("spawn")
+            sensorStore = SharedSensorStore(sensorStore.ids)
+            atexit.register(sensorStore.unlink)
+            messageQueue = processContext.Queue(MAX_MESSAGES)
+            messagePrintService = MessageForwarder(messageQueue)
+
+            # Render and ingest stats reach the Stats command in the network process
+            statsQueue = processContext.Queue(MAX_STATS_REPORTS)
+            forwardStats(statsQueue, "ingest")
+
+            # kill / systemd stop shuts down the same way the display exiting does
+            signal.signal(signal.SIGTERM, Terminate)
+
+            renderProcess = processContext.Process(target=RenderProcess, args=(sensorStore.name, messageQueue, statsQueue))
+            renderProcess.start()
+        else:
+            # Setup Display
+            if(DISPLAY_BACKEND == FRAMEBUFFER_DISPLAY):
+                display.useBackend(FramebufferWriter(FRAMEBUFFER_TARGET))
+            display.clearScreen()
+            display.hideCursor()
+
+            # Turn on message print service
+            messagePrintService = MessagePrintService()
+
+            # Display AWAS Structure
+            messagePrintService.displayStructure()
+
+        # Record before anything can append to the store
+        flightRecorder = None
+        if(RECORD_PATH is not None and DATA_SOURCE == REPLAY_DATA and
+                os.path.exists(RECORD_PATH) and os.path.samefile(RECORD_PATH, REPLAY_PATH)):
+            # Truncating the replay log would pull it out from under LogReader's mmap
+            messagePrintService.printClientMessage("Not recording over " + REPLAY_PATH)
+        elif(RECORD_PATH is not None):
+            flightRecorder = FlightRecorder(RECORD_PATH, sensorStore)
+            flightRecorder.start()
+
+        # With PROCESS_PIPELINE alerts run beside the server in the network process
+        alertEngine = None
+        if(ALERTS_ENABLED and PIPELINE == THREAD_PIPELINE):
+            alertEngine = AlertEngine(sensorStore)
+            alertEngine.addListener(AlertPane)
+            alertEngine.start()
 
         # Set up a connection status object (not used)
         connectionStatus = ConnectionStatus()
@@ -215,9 +330,8 @@ if __name__ == '__main__':
             messagePrintService.printClientMessage("Server started; Listening for connections on " + str(host) + \
                 ":" + str(port))
 
-            # Create a new thread to listen for incoming connections
-            t2 = Thread(target=ServerHost)
-            t2.start()
+            # Create a new thread (or process) to listen for incoming connections
+            t2 = StartServerHost()
 
         except OSError as e: #< Connection attempt failed
             messagePrintService.printClientMessage(str(e))
@@ -231,16 +345,51 @@ if __name__ == '__main__':
                 messagePrintService.printClientMessage("Server started; Listening for connections on " + str(host) + \
                     ":" + str(port))
 
-                # Create a new thread to listen for incoming connections
-                t2 = Thread(target=ServerHost)
-                t2.start()
+                # Create a new thread (or process) to listen for incoming connections
+                t2 = StartServerHost()
             
             except OSError as e: #< Second connection attempt failed
                 messagePrintService.printClientMessage(str(e))
                 messagePrintService.printClientMessage("ServerHost unable to start. Power cycle system and try again")
 
-        t1 = Thread(target=messagePrintService.displayData, args=(connectionStatus, sensorData_packages,))
-        t1.start()
+        if(MULTICAST_ENABLED):
+            multicastPublisher = MulticastPublisher(sensorStore)
+            multicastPublisher.start()
+            messagePrintService.printClientMessage("Multicasting snapshots to " + str(multicastPublisher.address[0]) + \
+                ":" + str(multicastPublisher.address[1]))
+
+        if(PIPELINE == THREAD_PIPELINE):
+            t1 = Thread(target=messagePrintService.displayData, args=(connectionStatus, sensorStore,))
+            t1.start()
+
+        # Start the sensor data
+        if(DATA_SOURCE == INGEST_DATA):
+            ingestListener = IngestListener(Ingestor(sensorStore))
+            ingestListener.start()
+            messagePrintService.printClientMessage("Sensor ingest on port " + str(ingestListener.port))
+        else:
+            if(DATA_SOURCE == LOAD_DATA):
+                t0 = Thread(target=LoadFeed)
+            elif(DATA_SOURCE == REPLAY_DATA):
+                t0 = Thread(target=ReplayFeed)
+            else:
+                t0 = Thread(target=DemoFeed)
+
+            # With PROCESS_PIPELINE the main thread below decides when this process ends
+            t0.daemon = (PIPELINE == PROCESS_PIPELINE)
+            t0.start()
+
+        if(PIPELINE == PROCESS_PIPELINE):
+            # Keep ingesting for as long as the display runs; once it is gone
+            # (or on Ctrl-C / SIGTERM) stop the other processes and drop the
+            # block's name so the shared memory is freed
+            try:
+                renderProcess.join()
+            finally:
+                for child in multiprocessing.active_children():
+                    child.terminate()
+                    child.join()
+                sensorStore.unlink()
 
     elif(RUNMODE == DEMO): # Print out sensorData_packages
         for sample in range(3):
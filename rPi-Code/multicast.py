@@ -0,0 +1,164 @@
+"""
+Title: Augmented Warfighter Awareness System Multicast Publisher
+Team: UCCS Senior Design "Heads Up" 2020
+
+Purpose: This file broadcasts each new squad snapshot once on a UDP
+         multicast group (or the subnet broadcast address), so the Pi does
+         the same work per update however many HoloLens units listen. Every
+         snapshot carries a publish sequence number; a receiver that sees a
+         gap asks the TCP server to Resync. A receiver-side assembler is
+         included for clients written in Python.
+
+"""
+import socket
+import struct
+from threading import Event, Thread
+import time
+import numpy as np
+import protocol
+import stats
+
+### <<< GROUP >>> ###
+MULTICAST_GROUP         =   "239.0.95.1"    # Or "<broadcast>" for the subnet broadcast address
+MULTICAST_PORT          =   9502
+MULTICAST_TTL           =   1               # Stay on the local network
+
+### <<< DATAGRAMS >>> ###
+MAX_DATAGRAM            =   1400            # Stays under a 1500 byte Ethernet MTU with IP/UDP headers
+RECORDS_PER_DATAGRAM    =   (MAX_DATAGRAM - protocol.DATAGRAM_HEADER.size) // protocol.RECORD.size
+PUBLISH_RATE            =   10              # Maximum snapshots per second
+
+def packDatagrams(sequence, version, ids, values):
+    # One snapshot -> list of datagrams, RECORDS_PER_DATAGRAM records each
+    records = protocol.packRecords(ids, values)
+    chunks = max(1, -(-len(ids) // RECORDS_PER_DATAGRAM))
+    chunkBytes = RECORDS_PER_DATAGRAM * protocol.RECORD.size
+
+    datagrams = []
+    for chunk in range(chunks):
+        body = records[chunk * chunkBytes : (chunk + 1) * chunkBytes]
+        header = protocol.DATAGRAM_HEADER.pack(sequence & 0xFFFFFFFF, version & 0xFFFFFFFF,
+                                               chunk, chunks, len(body) // protocol.RECORD.size)
+        datagrams.append(header + body)
+    return datagrams
+
+class MulticastPublisher(object):
+    """ Sends the newest snapshot from a SensorStore to the group whenever
+        the store changes, at most PUBLISH_RATE times a second. Appends in
+        between are coalesced, so the publish sequence always counts up by
+        one and any jump a receiver sees is a lost snapshot. """
+
+    def __init__(self, sensorStore, group=MULTICAST_GROUP, port=MULTICAST_PORT, ttl=MULTICAST_TTL, rate=PUBLISH_RATE, interface=None):
+        self.sensorStore = sensorStore
+        self.address = (group, port)
+        self.minInterval = 1.0 / rate if rate else 0
+        self.sequence = 0
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        if(group == "<broadcast>"):
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        else:
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+            if(interface is not None):
+                self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+
+        self.dataEvent = Event()
+        self.thread = None
+
+        self.publishTime = stats.registry.histogram("multicast.publish")
+        self.datagramsSent = stats.registry.counter("multicast.datagrams")
+        self.bytesSent = stats.registry.counter("multicast.bytes")
+        self.sendErrors = stats.registry.counter("multicast.errors")
+
+    def start(self):
+        self.sensorStore.addListener(self.onData)
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def onData(self, count):
+        self.dataEvent.set()
+
+    def publish(self):
+        start = stats.now()
+        self.sequence += 1
+        store = self.sensorStore
+
+        for datagram in packDatagrams(self.sequence, store.count, store.ids, store.latest()):
+            try:
+                self.sock.sendto(datagram, self.address)
+                self.datagramsSent.add()
+                self.bytesSent.add(len(datagram))
+            except OSError: #< e.g. no route to the group yet
+                self.sendErrors.add()
+
+        self.publishTime.recordSince(start)
+
+    def run(self):
+        while(1):
+            self.dataEvent.wait()
+            self.dataEvent.clear()
+            self.publish()
+
+            if(self.minInterval):
+                time.sleep(self.minInterval)
+
+### <<< RECEIVING >>> ###
+def openReceiver(group=MULTICAST_GROUP, port=MULTICAST_PORT, interface="0.0.0.0"):
+    # UDP socket bound to the port and joined to the group
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("", port))
+    if(group != "<broadcast>"):
+        membership = struct.pack("4s4s", socket.inet_aton(group), socket.inet_aton(interface))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+    return sock
+
+class SnapshotAssembler(object):
+    """ Rebuilds snapshots from datagrams. feed() returns (version, records)
+        once every chunk of a snapshot has arrived; records is a NumPy array
+        of protocol.RECORD_DTYPE. A snapshot that is skipped or left
+        incomplete counts as a gap, and needsResync is set until the caller
+        has fetched a full snapshot over TCP and called resynced(). """
+
+    def __init__(self):
+        self.lastSequence = None
+        self.sequence = None
+        self.chunkCount = None
+        self.chunks = {}
+        self.gaps = 0
+        self.needsResync = False
+
+    def feed(self, datagram):
+        header = protocol.DATAGRAM_HEADER
+        if(len(datagram) < header.size):
+            return None
+        (sequence, version, chunk, chunkCount, count) = header.unpack_from(datagram)
+        if(chunk >= chunkCount or len(datagram) < header.size + count * protocol.RECORD.size):
+            return None #< Malformed
+
+        if(self.lastSequence is not None and sequence <= self.lastSequence):
+            return None #< Late or duplicate
+
+        if(sequence != self.sequence):
+            # A snapshot still missing chunks is abandoned; the jump in
+            # sequence below counts it as a gap
+            self.sequence = sequence
+            self.chunkCount = chunkCount
+            self.chunks = {}
+        elif(chunkCount != self.chunkCount):
+            return None #< Disagrees with the snapshot's other chunks
+
+        self.chunks[chunk] = datagram[header.size : header.size + count * protocol.RECORD.size]
+        if(not all([i in self.chunks for i in range(chunkCount)])):
+            return None
+
+        if(self.lastSequence is not None and sequence != self.lastSequence + 1):
+            self.gaps += sequence - self.lastSequence - 1
+            self.needsResync = True
+        self.lastSequence = sequence
+
+        body = b"".join([self.chunks[i] for i in range(chunkCount)])
+        return (version, np.frombuffer(body, dtype=protocol.RECORD_DTYPE))
+
+    def resynced(self):
+        self.needsResync = False
@@ -0,0 +1,281 @@
+"""
+Title: Augmented Warfighter Awareness System Wire Protocol
+Team: UCCS Senior Design "Heads Up" 2020
+
+Purpose: This file defines the optional binary protocol spoken with the
+         HoloLens clients: length-prefixed frames, and a fixed struct
+         layout for each warrior record so a client can parse a Poll
+         response without any text handling.
+
+"""
+import struct
+import zlib
+import numpy as np
+import display
+import classify
+
+### <<< NEGOTIATION >>> ###
+# A client sends this (as a text command) to switch its connection to frames
+BINARY_COMMAND          =   "Binary"
+BINARY_ACK              =   "Binary OK\r\n"
+
+# "Compress [budget ms] [level]" switches the server's replies to FRAME_COMPRESSED
+COMPRESS_COMMAND        =   "Compress"
+COMPRESS_ACK            =   "Compress OK\r\n"
+
+### <<< FRAMES >>> ###
+# [u32 payload length][u8 frame type][payload]
+FRAME_HEADER            =   struct.Struct("<IB")
+MAX_FRAME_PAYLOAD       =   1 << 20
+
+FRAME_COMMAND           =   1   # client -> server, utf-8 command text
+FRAME_TEXT              =   2   # server -> client, utf-8 reply text
+FRAME_SNAPSHOT          =   3   # server -> client, SNAPSHOT_HEADER + records
+FRAME_KEYFRAME          =   4   # server -> client, pushed full snapshot (same layout)
+FRAME_DELTA             =   5   # server -> client, DELTA_HEADER + delta entries
+FRAME_HISTORY           =   6   # server -> client, HISTORY_HEADER + history buckets
+FRAME_INGEST            =   7   # sensor node -> ingest, one ingest batch
+FRAME_ALERT             =   8   # server -> client, ALERT_HEADER + alert entries
+FRAME_COMPRESSED        =   9   # server -> client, the next piece of one zlib stream
+FRAME_PROJECTION        =   10  # server -> client, PROJECTION_HEADER + projected records
+
+### <<< RECORDS >>> ###
+# [u32 sequence][u32 record count]
+SNAPSHOT_HEADER         =   struct.Struct("<II")
+
+# ID, ammo, water, HR, SpO2, temp, resp, weapon; a missing reading is NaN in
+# the float fields and all ones (e.g. 0xFFFF) in the integer fields
+RECORD                  =   struct.Struct("<HHfHBfBH")
+
+# The same layout as a NumPy dtype, for packing a whole squad at once
+RECORD_DTYPE            =   np.dtype([("id", "<u2"), ("ammo", "<u2"), ("water", "<f4"), ("hr", "<u2"),
+                                      ("spo2", "u1"), ("temp", "<f4"), ("resp", "u1"), ("weapon", "<u2")])
+
+# [u32 sequence][u32 base sequence][u32 entry count]
+DELTA_HEADER            =   struct.Struct("<III")
+
+# warrior ID, classify.FIELD_* index, new value
+DELTA_ENTRY             =   struct.Struct("<HBf")
+
+# [u32 sequence][u32 record count][u8 field mask (bit = classify.FIELD_*)], then
+# per warrior the ID and only the masked fields, laid out as in RECORD
+PROJECTION_HEADER       =   struct.Struct("<IIB")
+
+# [u16 warrior ID][u8 field][u32 bucket count]
+HISTORY_HEADER          =   struct.Struct("<HBI")
+
+# seconds before the newest sample, min, max, mean
+HISTORY_BUCKET          =   struct.Struct("<ffff")
+
+### <<< MULTICAST >>> ###
+# [u32 publish sequence][u32 store version][u16 chunk][u16 chunk count][u32 record count]
+# followed by this chunk's RECORDs; see multicast.py
+DATAGRAM_HEADER         =   struct.Struct("<IIHHI")
+
+# [u32 alert count]
+ALERT_HEADER            =   struct.Struct("<I")
+
+# timestamp, warrior ID, classify.FIELD_* index, old BAND_*, new BAND_*, value
+ALERT_ENTRY             =   struct.Struct("<dHBBBf")
+
+### <<< INGEST >>> ###
+# Sensor nodes push batches: one UDP datagram, or one FRAME_INGEST frame over TCP
+# [u16 magic][u16 record count][u32 node sequence] followed by INGEST_RECORDs
+INGEST_MAGIC            =   0x5741
+INGEST_HEADER           =   struct.Struct("<HHI")
+
+# A RECORD preceded by a mask of which fields were measured (bit = classify.FIELD_*)
+INGEST_DTYPE            =   np.dtype([("mask", "u1")] + RECORD_DTYPE.descr)
+INGEST_ALL_FIELDS       =   (1 << classify.FIELD_TOTAL) - 1
+
+### <<< COMPRESSION >>> ###
+COMPRESS_LEVEL          =   6
+COMPRESS_CHUNK          =   1 << 16     # Input bytes per FRAME_COMPRESSED at most
+
+def clampUnsigned(value, bits):
+    if(value is None or value != value): #< Missing reading
+        return (1 << bits) - 1
+    return min(max(int(value), 0), (1 << bits) - 1)
+
+def toFloat(value):
+    return float("nan") if value is None else float(value)
+
+def packFlatRecord(flat):
+    # flat: (ID, ammo, water, hr, spo2, temp, resp, weapon), the RECORD order
+    return RECORD.pack(
+        clampUnsigned(flat[0], 16),
+        clampUnsigned(flat[1], 16),
+        toFloat(flat[2]),
+        clampUnsigned(flat[3], 16),
+        clampUnsigned(flat[4], 8),
+        toFloat(flat[5]),
+        clampUnsigned(flat[6], 8),
+        clampUnsigned(flat[7], 16))
+
+def packRecord(record):
+    # record: [ID, ammo, water, [hr, spo2, temp, resp], weapon]
+    return packFlatRecord([record[display.ID_DATA]] + classify.flattenRecord(record))
+
+def packSnapshot(sequence, sensorData):
+    return SNAPSHOT_HEADER.pack(sequence & 0xFFFFFFFF, len(sensorData)) + \
+        b"".join([packRecord(record) for record in sensorData])
+
+def packFlatSnapshot(sequence, flatRecords):
+    return SNAPSHOT_HEADER.pack(sequence & 0xFFFFFFFF, len(flatRecords)) + \
+        b"".join([packFlatRecord(flat) for flat in flatRecords])
+
+def packArraySnapshot(sequence, ids, values):
+    # ids: (warriors,), values: (warriors, FIELD_TOTAL) -> same bytes as packSnapshot
+    return SNAPSHOT_HEADER.pack(sequence & 0xFFFFFFFF, len(ids)) + packRecords(ids, values)
+
+def packRecords(ids, values):
+    # RECORDs back to back, no header
+    records = np.empty(len(ids), dtype=RECORD_DTYPE)
+    records["id"] = np.clip(ids, 0, 0xFFFF)
+    for (field, name) in enumerate(classify.FIELD_NAMES):
+        column = values[:, field]
+        if(records.dtype[name].kind == "u"):
+            largest = np.iinfo(records.dtype[name]).max
+            column = np.where(np.isnan(column), largest, np.clip(column, 0, largest))
+        records[name] = column
+    return records.tobytes()
+
+def packIngestBatch(nodeSequence, ids, values, masks=INGEST_ALL_FIELDS):
+    # What a sensor node sends; values: (records, FIELD_TOTAL)
+    records = np.empty(len(ids), dtype=INGEST_DTYPE)
+    records["mask"] = masks
+    fields = np.frombuffer(packRecords(ids, np.asarray(values)), dtype=RECORD_DTYPE)
+    for name in RECORD_DTYPE.names:
+        records[name] = fields[name]
+    return INGEST_HEADER.pack(INGEST_MAGIC, len(ids), nodeSequence & 0xFFFFFFFF) + records.tobytes()
+
+def projectionDtype(mask):
+    names = ["id"] + [name for (field, name) in enumerate(classify.FIELD_NAMES) if mask & (1 << field)]
+    return np.dtype([(name, RECORD_DTYPE[name]) for name in names])
+
+def packProjection(sequence, ids, values, mask):
+    # Poll with fields=...; values: (warriors, FIELD_TOTAL), unmasked fields are left out
+    full = np.frombuffer(packRecords(ids, values), dtype=RECORD_DTYPE)
+    records = np.empty(len(ids), dtype=projectionDtype(mask))
+    for name in records.dtype.names:
+        records[name] = full[name]
+    return PROJECTION_HEADER.pack(sequence & 0xFFFFFFFF, len(ids), mask) + records.tobytes()
+
+def unpackProjection(payload):
+    # -> (sequence, field mask, NumPy records with "id" and the masked field names)
+    (sequence, count, mask) = PROJECTION_HEADER.unpack_from(payload)
+    records = np.frombuffer(payload, dtype=projectionDtype(mask), count=count, offset=PROJECTION_HEADER.size)
+    return (sequence, mask, records)
+
+def unpackSnapshot(payload):
+    # -> (sequence, [(id, ammo, water, hr, spo2, temp, resp, weapon), ...])
+    (sequence, count) = SNAPSHOT_HEADER.unpack_from(payload)
+    records = payload[SNAPSHOT_HEADER.size : SNAPSHOT_HEADER.size + count * RECORD.size]
+    return (sequence, list(RECORD.iter_unpack(records)))
+
+def packDelta(sequence, baseSequence, changes):
+    # changes: [(warrior ID, field, value), ...]
+    return DELTA_HEADER.pack(sequence & 0xFFFFFFFF, baseSequence & 0xFFFFFFFF, len(changes)) + \
+        b"".join([DELTA_ENTRY.pack(clampUnsigned(warrior, 16), field, toFloat(value)) for (warrior, field, value) in changes])
+
+def unpackDelta(payload):
+    # -> (sequence, base sequence, [(warrior ID, field, value), ...])
+    (sequence, baseSequence, count) = DELTA_HEADER.unpack_from(payload)
+    entries = payload[DELTA_HEADER.size : DELTA_HEADER.size + count * DELTA_ENTRY.size]
+    return (sequence, baseSequence, list(DELTA_ENTRY.iter_unpack(entries)))
+
+def packHistory(warrior, field, offsets, minimums, maximums, means):
+    buckets = np.column_stack([offsets, minimums, maximums, means]).astype("<f4")
+    return HISTORY_HEADER.pack(clampUnsigned(warrior, 16), field, len(buckets)) + buckets.tobytes()
+
+def unpackHistory(payload):
+    # -> (warrior ID, field, [(offset, min, max, mean), ...])
+    (warrior, field, count) = HISTORY_HEADER.unpack_from(payload)
+    buckets = payload[HISTORY_HEADER.size : HISTORY_HEADER.size + count * HISTORY_BUCKET.size]
+    return (warrior, field, list(HISTORY_BUCKET.iter_unpack(buckets)))
+
+def packAlerts(events):
+    # events: alerts.AlertEvent list
+    return ALERT_HEADER.pack(len(events)) + b"".join([ALERT_ENTRY.pack(event.timestamp, clampUnsigned(event.warrior, 16),
+        event.field, event.oldBand, event.newBand, event.value) for event in events])
+
+def unpackAlerts(payload):
+    # -> [(timestamp, warrior ID, field, old band, new band, value), ...]
+    (count,) = ALERT_HEADER.unpack_from(payload)
+    entries = payload[ALERT_HEADER.size : ALERT_HEADER.size + count * ALERT_ENTRY.size]
+    return list(ALERT_ENTRY.iter_unpack(entries))
+
+def packFrame(frameType, payload):
+    return FRAME_HEADER.pack(len(payload), frameType) + payload
+
+def buildDictionary():
+    # zlib preset dictionary: what replies on a quiet squad look like, so the
+    # first batch on a connection already has something to match against.
+    # Both ends build it from constants; it must never depend on live data.
+    ids = np.arange(1, 17)
+    values = np.tile([30, 2.5, 80, 98, 98.6, 16, 1], (len(ids), 1)).astype(np.float64)
+
+    text = ["Valid Commands", "Ping", "Poll", "Shutdown", "Binary", "Subscribe", "Unsubscribe", "Ack",
+            "History", "Stats", "Resync", "Alerts", "Compress", "Pong", "End", "Command: "]
+    text += ["Alert {} {} {} {} ".format(warrior, name, classify.BAND_NAMES[0], classify.BAND_NAMES[1])
+             for (warrior, name) in zip(ids, classify.FIELD_NAMES)]
+    text += [" ".join([str(warrior)] + [name + "=" for name in classify.FIELD_NAMES]) for warrior in ids[:4]]
+    text += ["[{}, 30, 2.5, [80, 98, 98.6, 16], 1]\r\n".format(warrior) for warrior in ids]
+    text += ["{} 30 2.5 80 98 98.6 16 1\r\n".format(warrior) for warrior in ids]
+
+    # Most common last: zlib reaches the end of the dictionary cheapest
+    return "\r\n".join(text).encode() + packFrame(FRAME_SNAPSHOT, SNAPSHOT_HEADER.pack(0, len(ids)) + packRecords(ids, values))
+
+COMPRESSION_DICTIONARY  =   buildDictionary()
+
+class Compressor(object):
+    """ One zlib stream per connection. Each call to compress() ends on a
+        sync flush, so the client can decode everything it has been sent
+        while later batches still match against the earlier ones. """
+
+    def __init__(self, level=COMPRESS_LEVEL):
+        self.stream = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, zdict=COMPRESSION_DICTIONARY)
+
+    def compress(self, data):
+        # -> FRAME_COMPRESSED frames, back to back
+        frames = []
+        for start in range(0, len(data), COMPRESS_CHUNK):
+            payload = self.stream.compress(data[start : start + COMPRESS_CHUNK]) + self.stream.flush(zlib.Z_SYNC_FLUSH)
+            frames.append(packFrame(FRAME_COMPRESSED, payload))
+        return b"".join(frames)
+
+class Decompressor(object):
+    """ Client side of Compressor: feed FRAME_COMPRESSED payloads in order
+        to get back the bytes the server would otherwise have sent. """
+
+    def __init__(self):
+        self.stream = zlib.decompressobj(zlib.MAX_WBITS, zdict=COMPRESSION_DICTIONARY)
+
+    def feed(self, payload):
+        return self.stream.decompress(payload)
+
+class FrameDecoder(object):
+    """ Reassembles frames from a byte stream, however the TCP segments
+        happen to be split or coalesced. """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        # Returns every complete (frameType, payload) received so far
+        self.buffer += data
+        frames = []
+
+        while(len(self.buffer) >= FRAME_HEADER.size):
+            (length, frameType) = FRAME_HEADER.unpack_from(self.buffer)
+            if(length > MAX_FRAME_PAYLOAD):
+                raise ValueError("Frame too large: " + str(length))
+
+            end = FRAME_HEADER.size + length
+            if(len(self.buffer) < end):
+                break
+
+            frames.append((frameType, bytes(self.buffer[FRAME_HEADER.size : end])))
+            del self.buffer[:end]
+
+        return frames
@@ -0,0 +1,194 @@
+"""
+Title: Augmented Warfighter Awareness System Flight Recorder
+Team: UCCS Senior Design "Heads Up" 2020
+
+Purpose: This file records every squad snapshot and client command to an
+         append-only binary log written through a memory map, with a small
+         index sidecar (<log>.idx) so a replay can seek to a timestamp
+         without scanning the log. Replay feeds the log back into a
+         SensorStore (and so the display and server) at 1x, Nx or as fast
+         as possible.
+
+"""
+import mmap
+import os
+import struct
+from threading import Lock
+import time
+import numpy as np
+import classify
+
+### <<< LOG FORMAT >>> ###
+# [8s magic][u32 warriors][u32 fields] then the warrior IDs as int64
+LOG_MAGIC               =   b"AWASLOG1"
+LOG_HEADER              =   struct.Struct("<8sII")
+
+# [f64 timestamp][u8 entry type][u32 payload length] then the payload
+ENTRY_HEADER            =   struct.Struct("<dBI")
+ENTRY_END               =   0   # Unwritten (zeroed) space past the last entry
+ENTRY_SNAPSHOT          =   1   # float32 values, (warriors, fields)
+ENTRY_COMMAND           =   2   # utf-8 "<address>\0<command>"
+
+# Sidecar index: [f64 timestamp][u64 offset of a snapshot entry]
+INDEX_ENTRY             =   np.dtype([("time", "<f8"), ("offset", "<u8")])
+INDEX_SUFFIX            =   ".idx"
+
+### <<< RECORDING >>> ###
+GROW_SIZE               =   16 << 20    # The log is extended and remapped this much at a time
+INDEX_INTERVAL          =   1.0         # Seconds of log between index entries
+
+### <<< REPLAY >>> ###
+REPLAY_SPEED            =   1.0         # 0 replays as fast as possible
+
+class FlightRecorder(object):
+    """ Appends entries to the log through an mmap that is grown GROW_SIZE
+        at a time. A crash leaves zeroed space after the last entry, which
+        readers treat as the end of the log. Safe to call from the store
+        writer thread and the server's event loop at the same time. """
+
+    def __init__(self, path, sensorStore):
+        self.path = path
+        self.sensorStore = sensorStore
+        self.lock = Lock()
+
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.size = 0
+        self.map = None
+        self.position = 0
+        self.grow(GROW_SIZE)
+
+        self.index = open(path + INDEX_SUFFIX, "wb")
+        self.lastIndexTime = None
+
+        ids = np.asarray(sensorStore.ids, dtype="<i8")
+        self.append(LOG_HEADER.pack(LOG_MAGIC, len(ids), classify.FIELD_TOTAL) + ids.tobytes())
+
+    def grow(self, minimum):
+        # Remap with room for at least `minimum` more bytes
+        if(self.map is not None):
+            self.map.close()
+        self.size += max(GROW_SIZE, minimum)
+        os.ftruncate(self.fd, self.size)
+        self.map = mmap.mmap(self.fd, self.size)
+
+    def append(self, data):
+        if(self.position + len(data) > self.size):
+            self.grow(len(data))
+        self.map[self.position : self.position + len(data)] = data
+        self.position += len(data)
+
+    def start(self):
+        self.sensorStore.addListener(self.onData)
+
+    def onData(self, count):
+        self.recordSnapshot(self.sensorStore.latest(), self.sensorStore.latestTime())
+
+    def recordSnapshot(self, values, timestamp):
+        payload = np.ascontiguousarray(values, dtype="<f4").tobytes()
+        with self.lock:
+            # Index entries always point at a snapshot, so replay can start there
+            if(self.lastIndexTime is None or timestamp - self.lastIndexTime >= INDEX_INTERVAL):
+                entry = np.array([(timestamp, self.position)], dtype=INDEX_ENTRY)
+                self.index.write(entry.tobytes())
+                self.index.flush()
+                self.lastIndexTime = timestamp
+
+            self.append(ENTRY_HEADER.pack(timestamp, ENTRY_SNAPSHOT, len(payload)) + payload)
+
+    def recordCommand(self, address, command, timestamp=None):
+        if(timestamp is None):
+            timestamp = time.time()
+        payload = (str(address) + "\0" + command).encode("utf-8", "replace")
+        with self.lock:
+            self.append(ENTRY_HEADER.pack(timestamp, ENTRY_COMMAND, len(payload)) + payload)
+
+    def close(self):
+        # Trim the unused tail so the file ends at the last entry
+        with self.lock:
+            self.map.flush()
+            self.map.close()
+            os.ftruncate(self.fd, self.position)
+            os.close(self.fd)
+            self.index.close()
+
+class LogReader(object):
+    """ Reads a flight recorder log through a read-only mmap. entries()
+        yields (timestamp, type, payload) from any offset; seek() finds the
+        offset to start from with a binary search of the index sidecar. """
+
+    def __init__(self, path):
+        with open(path, "rb") as log:
+            self.map = mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, warriors, fields) = LOG_HEADER.unpack_from(self.map)
+        if(magic != LOG_MAGIC):
+            raise ValueError("Not a flight recorder log: " + path)
+        self.ids = np.frombuffer(self.map, dtype="<i8", count=warriors, offset=LOG_HEADER.size).copy()
+        self.shape = (warriors, fields)
+        self.start = LOG_HEADER.size + 8 * warriors
+
+        if(os.path.exists(path + INDEX_SUFFIX)):
+            self.index = np.fromfile(path + INDEX_SUFFIX, dtype=INDEX_ENTRY)
+        else:
+            self.index = np.zeros(0, dtype=INDEX_ENTRY)
+
+    def seek(self, timestamp):
+        # Offset of the last indexed snapshot at or before timestamp
+        i = np.searchsorted(self.index["time"], timestamp, side="right") - 1
+        return int(self.index["offset"][i]) if i >= 0 else self.start
+
+    def entries(self, offset=None):
+        position = self.start if offset is None else offset
+        while(position + ENTRY_HEADER.size <= len(self.map)):
+            (timestamp, entryType, length) = ENTRY_HEADER.unpack_from(self.map, position)
+            position += ENTRY_HEADER.size
+            if(entryType == ENTRY_END or position + length > len(self.map)):
+                return
+
+            payload = self.map[position : position + length]
+            position += length
+            yield (timestamp, entryType, payload)
+
+    def snapshot(self, payload):
+        return np.frombuffer(payload, dtype="<f4").reshape(self.shape)
+
+    def command(self, payload):
+        # -> (address, command)
+        (address, command) = payload.decode("utf-8", "replace").split("\0", 1)
+        return (address, command)
+
+class Replayer(object):
+    """ Plays a log back into a SensorStore with the original timestamps,
+        and shows recorded client commands in the message pane. speed is a
+        multiple of real time; 0 plays as fast as possible. """
+
+    def __init__(self, reader, sensorStore, messagePrintService=None, speed=REPLAY_SPEED):
+        self.reader = reader
+        self.sensorStore = sensorStore
+        self.messagePrintService = messagePrintService
+        self.speed = speed
+
+    def run(self, startTime=None, endTime=None):
+        offset = None if startTime is None else self.reader.seek(startTime)
+        logStart = None
+        wallStart = time.monotonic()
+
+        for (timestamp, entryType, payload) in self.reader.entries(offset):
+            # The index only gets us close; skip up to the requested time
+            if(startTime is not None and timestamp < startTime):
+                continue
+            if(endTime is not None and timestamp > endTime):
+                break
+
+            if(logStart is None):
+                logStart = timestamp
+            if(self.speed):
+                delay = wallStart + (timestamp - logStart) / self.speed - time.monotonic()
+                if(delay > 0):
+                    time.sleep(delay)
+
+            if(entryType == ENTRY_SNAPSHOT):
+                self.sensorStore.append(self.reader.snapshot(payload), timestamp)
+            elif(entryType == ENTRY_COMMAND and self.messagePrintService is not None):
+                (address, command) = self.reader.command(payload)
+                self.messagePrintService.printClientMessage("Replay " + address + ": " + command)
@@ -0,0 +1,139 @@
+"""
+Title: Augmented Warfighter Awareness System Sensor Store
+Team: UCCS Senior Design "Heads Up" 2020
+
+Purpose: This file holds the live squad state as compact typed arrays,
+         one value per (warrior, field), with a fixed-size ring buffer of
+         recent samples. The display, the server and any analytics read
+         from here instead of the nested sensorData lists.
+
+"""
+import time
+import numpy as np
+import display
+import classify
+
+### <<< STORE SIZE >>> ###
+HISTORY_LENGTH          =   1024    # Samples kept per warrior and field
+VALUE_TYPE              =   np.float32
+
+class SensorStore(object):
+    """ Columnar sensor store.
+
+        values[warrior, field, slot] holds every field of every warrior for
+        the last `capacity` samples, and times[slot] when each was taken.
+        Each sample is written to two slots, i and i + capacity, so any run
+        of up to `capacity` recent samples is one contiguous slice and can
+        be handed out as a view without copying. """
+
+    def __init__(self, ids, history=HISTORY_LENGTH):
+        self.ids = np.array(ids, dtype=np.int64)
+        self.idIndex = dict([(int(warriorId), i) for (i, warriorId) in enumerate(self.ids)])
+        self.capacity = history
+
+        # NaN until a warrior reports: a missing reading, not a zero one
+        self.values = np.full((len(self.ids), classify.FIELD_TOTAL, 2 * history), np.nan, dtype=VALUE_TYPE)
+        self.times = np.zeros(2 * history, dtype=np.float64)
+
+        # Samples appended so far; doubles as the version of the live state
+        self.count = 0
+
+        # Called with the new count after every append (on the writer's thread)
+        self.listeners = []
+
+    def __len__(self):
+        # Number of warriors
+        return len(self.ids)
+
+    def addListener(self, listener):
+        self.listeners.append(listener)
+
+    def append(self, values, timestamp=None):
+        # values: (warriors, FIELD_TOTAL) in classify.FIELD_* order
+        if(timestamp is None):
+            timestamp = time.time()
+
+        slot = self.count % self.capacity
+        self.values[:, :, slot] = values
+        self.values[:, :, slot + self.capacity] = values
+        self.times[slot] = timestamp
+        self.times[slot + self.capacity] = timestamp
+
+        # Publish only once the sample is completely written
+        self.count += 1
+        for listener in self.listeners:
+            listener(self.count)
+
+    def latestSlot(self):
+        return (self.count - 1) % self.capacity + self.capacity
+
+    def latest(self, first=0, last=None):
+        # (warriors, FIELD_TOTAL) view of the newest sample, no copy
+        return self.values[first:last, :, self.latestSlot()]
+
+    def latestTime(self):
+        return self.times[self.latestSlot()] if self.count else 0.0
+
+    def history(self, warrior, field, samples=None):
+        # (times, values) views of the newest `samples` readings, oldest first
+        available = min(self.count, self.capacity)
+        if(samples is None or samples > available):
+            samples = available
+
+        end = self.latestSlot() + 1
+        return (self.times[end - samples : end], self.values[warrior, field, end - samples : end])
+
+    def window(self, warrior, field, seconds):
+        # (times, values) views covering the last `seconds` of history
+        (times, values) = self.history(warrior, field)
+        newest = times[-1] if len(times) else 0.0
+        start = np.searchsorted(times, newest - seconds, side="left")
+        return (times[start:], values[start:])
+
+    def flatRecords(self, first=0, last=None):
+        # [[ID, ammo, water, hr, spo2, temp, resp, weapon], ...] as plain numbers
+        ids = self.ids[first:last].tolist()
+        rows = toNumbers(self.latest(first, last))
+        return [[warriorId] + row for (warriorId, row) in zip(ids, rows)]
+
+    def records(self, first=0, last=None):
+        # [[ID, ammo, water, [hr, spo2, temp, resp], weapon], ...] like sensorData
+        return [nestRecord(flat) for flat in self.flatRecords(first, last)]
+
+def nestRecord(flat):
+    # [ID, ammo, water, hr, spo2, temp, resp, weapon] -> the sensorData layout
+    record = [None] * (display.WEAPON_DATA + 1)
+    record[display.ID_DATA] = flat[0]
+    record[display.AMMO_DATA] = flat[1 + classify.FIELD_AMMO]
+    record[display.WATER_DATA] = flat[1 + classify.FIELD_WATER]
+    vitals = [None] * (display.RESP_DATA + 1)
+    vitals[display.HR_DATA] = flat[1 + classify.FIELD_HR]
+    vitals[display.SPO2_DATA] = flat[1 + classify.FIELD_SPO2]
+    vitals[display.TEMP_DATA] = flat[1 + classify.FIELD_TEMP]
+    vitals[display.RESP_DATA] = flat[1 + classify.FIELD_RESP]
+    record[display.VITALS_DATA] = vitals
+    record[display.WEAPON_DATA] = flat[1 + classify.FIELD_WEAPON]
+    return record
+
+def toNumbers(values):
+    # float32 array -> nested lists of ints / floats as a person would write
+    # them, with None for a missing (NaN) reading
+    rounded = np.round(np.asarray(values, dtype=np.float64), 2).tolist()
+    return [[None if v != v else int(v) if v.is_integer() else v for v in row] for row in rounded]
+
+def downsample(times, values, points):
+    # Min / max / mean buckets so the result never has more than `points` rows.
+    # -> (bucket times, minimums, maximums, means); bucket time is its first sample
+    count = len(values)
+    if(count <= points):
+        values = np.asarray(values, dtype=np.float64)
+        return (np.asarray(times), values, values, values)
+
+    starts = np.linspace(0, count, points + 1).astype(np.intp)[:-1]
+    sizes = np.diff(np.append(starts, count))
+    values = np.asarray(values, dtype=np.float64)
+
+    return (np.asarray(times)[starts],
+            np.minimum.reduceat(values, starts),
+            np.maximum.reduceat(values, starts),
+            np.add.reduceat(values, starts) / sizes)
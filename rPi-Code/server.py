@@ -0,0 +1,957 @@
+"""
+Title: Augmented Warfighter Awareness System Server
+Team: UCCS Senior Design "Heads Up" 2020
+
+Purpose: This file is intended to serve the simulated sensor data to any
+         number of Microsoft HoloLens clients at once, using an asyncio
+         TCP server so one slow client never holds up the others.
+
+"""
+import asyncio
+import math
+import re
+import socket
+import time
+from collections import OrderedDict, deque
+import numpy as np
+import alerts
+import classify
+import protocol
+import sensorstore
+import stats
+
+### <<< PROTOCOL TEXT >>> ###
+WELCOME_MESSAGE         =   "Welcome to the Augmented Warfighter Awareness System\r\n"
+BANNER_HEADER           =   "\r\n\r\nValid Commands: \r\n"
+COMMAND_PROMPT          =   "\r\nCommand: "   # After every text reply; the full banner only on connect and Help
+RECV_SIZE               =   65536
+
+### <<< POLL >>> ###
+BAND_FILTER             =   re.compile(r"^band(>=|<=|==|=|>|<)([a-z]+)$")
+BAND_COMPARISONS        =   {">=": np.greater_equal, ">": np.greater, "<=": np.less_equal,
+                             "<": np.less, "=": np.equal, "==": np.equal}
+
+### <<< HISTORY >>> ###
+HISTORY_POINTS          =   60      # Default buckets in a History reply
+MAX_HISTORY_POINTS      =   500     # Upper bound, whatever the client asks for
+
+### <<< STREAMING >>> ###
+SUBSCRIBE_RATE          =   5       # Default maximum pushes per second
+KEYFRAME_INTERVAL       =   10      # Deltas between full keyframes
+MAX_UNACKED_SNAPSHOTS   =   32      # Pushed snapshots a client may still Ack
+
+### <<< COMPRESSION >>> ###
+COMPRESS_BUDGET         =   0.05    # Default seconds output may wait to join a batch
+
+### <<< SLOW CONSUMERS >>> ###
+MAX_QUEUED_BYTES        =   1 << 18 # Output a client may have waiting to be sent
+MAX_LAG                 =   5.0     # Seconds the oldest queued output may wait
+
+POLICY_DROP             =   "drop"          # Drop queued pushed snapshots, resend a keyframe later
+POLICY_DISCONNECT       =   "disconnect"    # Drop the client once it falls MAX_LAG behind
+SLOW_CONSUMER_POLICY    =   POLICY_DROP
+
+### <<< COMMAND PARSING >>> ###
+class CommandParser(object):
+    """ Splits what a client sends into commands, however TCP groups it.
+
+        Text commands end with a newline, so any number can arrive in one
+        read and a partial one waits for the rest. A client that has never
+        sent a newline (e.g. the original HoloLens app) is sent one command
+        per read, as before. After useFrames() the rest of the stream is
+        parsed as FRAME_COMMAND frames. """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.lines = False
+        self.frames = False
+
+    def feed(self, data):
+        self.buffer += data
+
+    def useFrames(self):
+        # Whatever follows the Binary command is already framed
+        self.frames = True
+
+    def next(self):
+        # The next complete command, or None until more data arrives
+        while(self.buffer):
+            if(self.frames):
+                if(len(self.buffer) < protocol.FRAME_HEADER.size):
+                    return None
+                (length, frameType) = protocol.FRAME_HEADER.unpack_from(self.buffer)
+                if(length > protocol.MAX_FRAME_PAYLOAD):
+                    raise ValueError("Frame too large: " + str(length))
+
+                end = protocol.FRAME_HEADER.size + length
+                if(len(self.buffer) < end):
+                    return None
+                (command, frameType) = (bytes(self.buffer[protocol.FRAME_HEADER.size : end]), frameType)
+                del self.buffer[:end]
+                if(frameType != protocol.FRAME_COMMAND):
+                    continue
+            else:
+                newline = self.buffer.find(b"\n")
+                if(newline >= 0):
+                    self.lines = True
+                    command = bytes(self.buffer[:newline])
+                    del self.buffer[:newline + 1]
+                elif(self.lines):
+                    return None
+                else:
+                    command = bytes(self.buffer)
+                    self.buffer.clear()
+
+            command = command.decode("utf-8", "replace").strip()
+            if(command):
+                return command
+        return None
+
+class Command(object):
+    __slots__ = ["handler", "usage"]
+
+    def __init__(self, handler, usage):
+        self.handler = handler      # handler(connection, arguments); returns False to close the connection
+        self.usage = usage          # Line shown in the banner
+
+### <<< PER CONNECTION STATISTICS >>> ###
+class ConnectionStats(object):
+    """ Throughput and command latency for one client connection. Latency
+        is measured from receiving a command to its reply being queued. """
+
+    def __init__(self):
+        self.connectedAt = time.monotonic()
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.commands = 0
+        self.totalLatency = 0.0
+        self.maxLatency = 0.0
+
+        # Compressed batches: bytes before and after zlib, and how long the
+        # first byte of each batch waited for it to go out
+        self.batches = 0
+        self.batchedBytes = 0
+        self.compressedBytes = 0
+        self.totalBatchWait = 0.0
+        self.maxBatchWait = 0.0
+
+        # Send queue high water mark and pushed snapshots dropped from it
+        self.peakQueued = 0
+        self.snapshotsDropped = 0
+        self.tooSlow = False
+
+    def recordCommand(self, latency):
+        self.commands += 1
+        self.totalLatency += latency
+        if(latency > self.maxLatency):
+            self.maxLatency = latency
+
+    def recordBatch(self, size, compressedSize, wait):
+        self.batches += 1
+        self.batchedBytes += size
+        self.compressedBytes += compressedSize
+        self.totalBatchWait += wait
+        if(wait > self.maxBatchWait):
+            self.maxBatchWait = wait
+
+    def summary(self):
+        elapsed = max(time.monotonic() - self.connectedAt, 1e-6)
+        averageLatency = self.totalLatency / self.commands if self.commands else 0.0
+
+        summary = "in {}B out {}B ({:.0f}B/s) cmds {} lat avg {:.1f}ms max {:.1f}ms".format(
+            self.bytesIn, self.bytesOut, (self.bytesIn + self.bytesOut) / elapsed,
+            self.commands, averageLatency * 1000, self.maxLatency * 1000)
+
+        if(self.snapshotsDropped or self.tooSlow):
+            summary += " queue peak {}B dropped {}".format(self.peakQueued, self.snapshotsDropped)
+            if(self.tooSlow):
+                summary += " (too slow, disconnected)"
+        if(self.batches):
+            summary += " zlib {}B->{}B ({:.1f}x) batches {} wait avg {:.1f}ms max {:.1f}ms".format(
+                self.batchedBytes, self.compressedBytes, self.batchedBytes / max(self.compressedBytes, 1),
+                self.batches, self.totalBatchWait / self.batches * 1000, self.maxBatchWait * 1000)
+        return summary
+
+### <<< STREAMING >>> ###
+def makeSnapshot(sensorStore):
+    # Immutable (ID, ammo, water, hr, spo2, temp, resp, weapon) per warrior
+    return tuple([tuple(record) for record in sensorStore.flatRecords()])
+
+class Subscription(object):
+    """ Push state for one subscribed client. Each delta is encoded against
+        the last snapshot the client acknowledged with "Ack <seq>" (or the
+        last keyframe if it never acks) and names that base, so the client
+        rebuilds the full state from a snapshot it already holds. """
+
+    def __init__(self, rate=SUBSCRIBE_RATE, keyframeInterval=KEYFRAME_INTERVAL):
+        self.minInterval = 1.0 / rate if rate > 0 else 0.0
+        self.keyframeInterval = keyframeInterval
+
+        # Set whenever new data is available (starts set to push a keyframe now)
+        self.changed = asyncio.Event()
+        self.changed.set()
+
+        self.sequence = 0
+        self.lastSnapshot = None
+        self.baseSequence = None
+        self.baseSnapshot = None
+        self.sinceKeyframe = 0
+
+        # sequence -> snapshot, for pushes not yet acknowledged
+        self.sent = OrderedDict()
+        self.task = None
+
+    def acknowledge(self, sequence):
+        # Only a newer snapshot than the current base can become the base
+        snapshot = self.sent.get(sequence)
+        if(snapshot is None):
+            return False
+
+        self.baseSequence = sequence
+        self.baseSnapshot = snapshot
+        for older in [s for s in self.sent if s <= sequence]:
+            del self.sent[older]
+        return True
+
+    def nextUpdate(self, snapshot):
+        # -> (sequence, None, snapshot) for a keyframe,
+        #    (sequence, base, changes) for a delta, or None if the client
+        #    already holds this snapshot (last push or acknowledged base)
+        if(snapshot == self.lastSnapshot):
+            return None
+        self.lastSnapshot = snapshot
+
+        base = self.baseSnapshot
+        keyframe = base is None or self.sinceKeyframe >= self.keyframeInterval or \
+            [record[0] for record in base] != [record[0] for record in snapshot]
+
+        if(keyframe):
+            self.sequence += 1
+            self.baseSequence = self.sequence
+            self.baseSnapshot = snapshot
+            self.sinceKeyframe = 0
+            self.sent.clear()
+            return (self.sequence, None, snapshot)
+
+        changes = []
+        for (record, baseRecord) in zip(snapshot, base):
+            if(record != baseRecord):
+                for field in range(classify.FIELD_TOTAL):
+                    if(record[field + 1] != baseRecord[field + 1]):
+                        changes.append((record[0], field, record[field + 1]))
+
+        # Back to exactly the base: the client already holds this state
+        if(not changes):
+            return None
+
+        self.sequence += 1
+        self.sinceKeyframe += 1
+        self.sent[self.sequence] = snapshot
+        while(len(self.sent) > MAX_UNACKED_SNAPSHOTS):
+            self.sent.popitem(last=False)
+        return (self.sequence, self.baseSequence, changes)
+
+    def forceKeyframe(self):
+        # The client never received some of what was pushed; start over
+        self.lastSnapshot = None
+        self.baseSnapshot = None
+        self.changed.set()
+
+### <<< INSTRUMENTATION >>> ###
+# Shared by every connection; see stats.py
+RECV_WAIT               =   stats.registry.histogram("server.recvWait")     # Idle, waiting on the client
+DISPATCH_TIME           =   stats.registry.histogram("server.dispatch")     # Whole command, up to its reply being queued
+SEND_TIME               =   stats.registry.histogram("server.send")         # Waiting for the socket to drain
+COMMANDS                =   stats.registry.counter("server.commands")
+BYTES_IN                =   stats.registry.counter("server.bytesIn")
+BYTES_OUT               =   stats.registry.counter("server.bytesOut")
+BATCH_WAIT              =   stats.registry.histogram("server.batchWait")    # Output held back for a compressed batch
+BATCHED_BYTES           =   stats.registry.counter("server.batchedBytes")   # Before zlib
+COMPRESSED_BYTES        =   stats.registry.counter("server.compressedBytes")
+QUEUE_WAIT              =   stats.registry.histogram("server.queueWait")    # Oldest output waiting in a send queue
+SNAPSHOTS_DROPPED       =   stats.registry.counter("server.snapshotsDropped")
+SLOW_DISCONNECTS        =   stats.registry.counter("server.slowDisconnects")
+
+### <<< POLL >>> ###
+def splitList(argument):
+    # "ids=1,3" -> ["1", "3"]; an empty list selects nothing, so reject it
+    (name, text) = argument.split("=", 1)
+    items = [item for item in text.split(",") if item]
+    if(not items):
+        raise ValueError("Empty " + name + "= list")
+    return items
+
+def parseId(text):
+    try:
+        return int(text)
+    except ValueError:
+        raise ValueError("Bad warrior ID: " + text)
+
+def parseField(name):
+    if(name not in classify.FIELD_INDEX):
+        raise ValueError("Unknown field: " + name)
+    return classify.FIELD_INDEX[name]
+
+class PollQuery(object):
+    """ Poll [ids=1,3] [fields=ammo,weapon] [band>=red]
+
+        ids picks warriors (unknown IDs are skipped), fields picks what is
+        sent for each, and band keeps only warriors with at least one of
+        those fields in a matching band. Names are resolved to store rows
+        and FIELD_* columns once, then applied to the latest sample with
+        NumPy indexing and masks. """
+
+    def __init__(self, arguments):
+        # arguments: the words after "Poll"; raises ValueError if malformed
+        self.ids = None         # Warrior IDs, None for everyone
+        self.fields = None      # classify.FIELD_* list, None for all
+        self.band = None        # (comparison ufunc, classify.BAND_*)
+
+        for argument in [argument.lower() for argument in arguments]:
+            match = BAND_FILTER.match(argument)
+            if(match):
+                if(match.group(2) not in classify.BAND_INDEX):
+                    raise ValueError("Unknown band: " + match.group(2))
+                self.band = (BAND_COMPARISONS[match.group(1)], classify.BAND_INDEX[match.group(2)])
+            elif(argument.startswith("ids=")):
+                self.ids = [parseId(warrior) for warrior in splitList(argument)]
+            elif(argument.startswith("fields=")):
+                self.fields = sorted(set([parseField(name) for name in splitList(argument)]))
+            else:
+                raise ValueError("Unknown Poll argument: " + argument)
+
+    def mask(self):
+        # Bit per projected field, as in protocol.PROJECTION_HEADER
+        return sum([1 << field for field in self.fields])
+
+    def select(self, sensorStore, classifier):
+        # -> (ids, values) of the matching warriors, values (warriors, FIELD_TOTAL)
+        ids = sensorStore.ids
+        values = sensorStore.latest()
+        if(self.ids is not None):
+            rows = np.array([sensorStore.idIndex[warrior] for warrior in self.ids if warrior in sensorStore.idIndex], dtype=np.intp)
+            (ids, values) = (ids[rows], values[rows])
+
+        if(self.band is not None):
+            (compare, band) = self.band
+            bands = classifier.classify(values)
+            if(self.fields is not None):
+                bands = bands[:, self.fields]
+            # A missing reading matches no band
+            missing = np.isnan(values) if self.fields is None else np.isnan(values[:, self.fields])
+            keep = (compare(bands, band) & ~missing).any(axis=1)
+            (ids, values) = (ids[keep], values[keep])
+        return (ids, values)
+
+### <<< HISTORY >>> ###
+def parseSeconds(text):
+    # "90", "90s", "5m" or "1h" -> seconds; ValueError unless finite and positive
+    scale = {"s": 1, "m": 60, "h": 3600}
+    try:
+        if(text[-1:].lower() in scale):
+            seconds = float(text[:-1]) * scale[text[-1].lower()]
+        else:
+            seconds = float(text)
+    except ValueError:
+        raise ValueError("Bad window: " + text)
+
+    if(not math.isfinite(seconds) or seconds <= 0):
+        raise ValueError("Bad window: " + text)
+    return seconds
+
+### <<< CLIENT CONNECTION >>> ###
+class QueuedWrite(object):
+    __slots__ = ["data", "snapshot", "compressor", "queuedAt"]
+
+    def __init__(self, data, snapshot, compressor):
+        self.data = data
+        self.snapshot = snapshot        # A pushed update that a later keyframe can replace
+        self.compressor = compressor    # protocol.Compressor it goes out through, or None
+        self.queuedAt = time.monotonic()
+
+class ClientConnection(object):
+    """ Nothing on the event loop ever waits for this client's socket.
+        Output is queued (at most MAX_QUEUED_BYTES) and written by the
+        connection's own sender task, which is the only thing that waits
+        for the socket to drain. When the client falls behind, policy
+        decides what gives: POLICY_DROP throws away queued snapshot pushes
+        (the subscription resends a keyframe of the latest state) and only
+        disconnects if replies alone overflow the queue; POLICY_DISCONNECT
+        drops the client once its oldest queued output is MAX_LAG old. """
+
+    def __init__(self, reader, writer, policy=SLOW_CONSUMER_POLICY):
+        self.reader = reader
+        self.writer = writer
+        self.address = writer.get_extra_info("peername")
+        self.stats = ConnectionStats()
+        self.policy = policy
+
+        # Each reply goes out as one write; don't let Nagle hold it back
+        # (asyncio only does this itself when the listening socket was
+        # created with proto=IPPROTO_TCP, which main.py's isn't)
+        sock = writer.get_extra_info("socket")
+        if(sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6)):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        # Switched on by the Binary command; frames in both directions from then on
+        self.binary = False
+
+        # Set while the client is subscribed to pushed updates
+        self.subscription = None
+
+        # Set by "Alerts on"; band change events are pushed as they happen
+        self.alerts = False
+
+        # Output written since the last flush, queued as a single write
+        self.pending = []
+
+        # Set by the Compress command; queued output then waits up to
+        # `budget` seconds so it can go out in one compressed batch
+        self.compressor = None
+        self.budget = COMPRESS_BUDGET
+
+        # QueuedWrites not yet handed to the socket
+        self.queue = deque()
+        self.queuedBytes = 0
+        self.ready = asyncio.Event()
+        self.sender = asyncio.ensure_future(self.sendQueued())
+        self.closed = False
+
+    def write(self, data):
+        self.pending.append(data)
+
+    def send(self, data):
+        self.write(data)
+        self.flush()
+
+    def flush(self, snapshot=False):
+        # Queue everything written since the last flush; never blocks
+        if(not self.pending or self.closed):
+            self.pending = []
+            return
+        data = b"".join(self.pending)
+        self.pending = []
+
+        self.queue.append(QueuedWrite(data, snapshot, self.compressor))
+        self.queuedBytes += len(data)
+        if(self.queuedBytes > self.stats.peakQueued):
+            self.stats.peakQueued = self.queuedBytes
+        self.ready.set()
+
+        if(self.policy == POLICY_DISCONNECT):
+            tooSlow = time.monotonic() - self.queue[0].queuedAt > MAX_LAG or self.queuedBytes > MAX_QUEUED_BYTES
+        else:
+            if(self.queuedBytes > MAX_QUEUED_BYTES):
+                self.dropSnapshots()
+            tooSlow = self.queuedBytes > MAX_QUEUED_BYTES
+
+        if(tooSlow):
+            self.stats.tooSlow = True
+            SLOW_DISCONNECTS.add()
+            self.abort()
+
+    def dropSnapshots(self):
+        # Keep replies and alerts; the latest state follows as a keyframe
+        kept = deque([queued for queued in self.queue if not queued.snapshot])
+        dropped = len(self.queue) - len(kept)
+        if(not dropped):
+            return
+
+        self.queue = kept
+        self.queuedBytes = sum([len(queued.data) for queued in kept])
+        self.stats.snapshotsDropped += dropped
+        SNAPSHOTS_DROPPED.add(dropped)
+        if(self.subscription is not None):
+            self.subscription.forceKeyframe()
+
+    async def sendQueued(self):
+        # The connection's sender task
+        try:
+            while(1):
+                await self.ready.wait()
+                self.ready.clear()
+                if(not self.queue):
+                    continue
+
+                # Give a compressed batch the rest of its budget to fill up
+                if(self.queue[0].compressor is not None):
+                    delay = self.queue[0].queuedAt + self.budget - time.monotonic()
+                    if(delay > 0):
+                        await asyncio.sleep(delay)
+
+                queued = list(self.queue)
+                self.queue.clear()
+                self.queuedBytes = 0
+                QUEUE_WAIT.record(int((time.monotonic() - queued[0].queuedAt) * 1e9))
+
+                self.transmit(self.encode(queued))
+                start = stats.now()
+                await self.writer.drain()
+                SEND_TIME.recordSince(start)
+
+        except (ConnectionError, OSError):
+            self.abort()
+
+    def encode(self, queued):
+        # Plain writes as they are; each run through a compressor as one batch
+        output = []
+        run = []
+        for write in queued + [None]:
+            if(run and (write is None or write.compressor is not run[0].compressor)):
+                data = b"".join([each.data for each in run])
+                if(run[0].compressor is None):
+                    output.append(data)
+                else:
+                    compressed = run[0].compressor.compress(data)
+                    output.append(compressed)
+
+                    wait = time.monotonic() - run[0].queuedAt
+                    self.stats.recordBatch(len(data), len(compressed), wait)
+                    BATCH_WAIT.record(int(wait * 1e9))
+                    BATCHED_BYTES.add(len(data))
+                    COMPRESSED_BYTES.add(len(compressed))
+                run = []
+            if(write is not None):
+                run.append(write)
+        return b"".join(output)
+
+    def transmit(self, data):
+        self.writer.write(data)
+        self.stats.bytesOut += len(data)
+        BYTES_OUT.add(len(data))
+
+    def startCompression(self, budget, level):
+        # Output already written goes out as it was
+        self.flush()
+        self.compressor = protocol.Compressor(level)
+        self.budget = budget
+
+    def stopCompression(self):
+        # Output already written still goes through the compressor
+        self.flush()
+        self.compressor = None
+
+    async def recv(self):
+        data = await self.reader.read(RECV_SIZE)
+        self.stats.bytesIn += len(data)
+        BYTES_IN.add(len(data))
+        return data
+
+    def writeText(self, text):
+        # Reply text, framed when the client speaks binary
+        if(self.binary):
+            self.write(protocol.packFrame(protocol.FRAME_TEXT, text.encode()))
+        else:
+            self.write(text.encode())
+
+    def abort(self):
+        # Drop what is queued and reset the connection, which also ends
+        # the read waiting in handleClient
+        if(not self.closed):
+            self.closed = True
+            self.queue.clear()
+            self.queuedBytes = 0
+            self.sender.cancel()
+            self.writer.transport.abort()
+
+    def close(self):
+        # Whatever is still queued is left with the transport to send
+        if(not self.closed):
+            self.flush()
+            self.closed = True
+            self.sender.cancel()
+            if(self.queue):
+                self.transmit(self.encode(list(self.queue)))
+            self.writer.close()
+
+### <<< SERVER HOST >>> ###
+class AsyncServerHost(object):
+    """ Accepts any number of clients on one event loop. Each connection's
+        commands are parsed by a CommandParser and looked up in the command
+        table, so a new command only needs a register() call. """
+
+    def __init__(self, messagePrintService, sensorStore, host, port, recorder=None, alertEngine=None,
+                 slowConsumerPolicy=SLOW_CONSUMER_POLICY):
+        self.messagePrintService = messagePrintService
+        self.sensorStore = sensorStore
+        self.host = host
+        self.port = port
+
+        # Optional recorder.FlightRecorder that logs every client command
+        self.recorder = recorder
+
+        # Optional alerts.AlertEngine whose events clients can opt in to
+        self.alertEngine = alertEngine
+
+        # POLICY_DROP or POLICY_DISCONNECT for clients that can't keep up
+        self.slowConsumerPolicy = slowConsumerPolicy
+
+        # Bands for Poll's band filter
+        self.classifier = classify.getClassifier()
+
+        # Command name (lower case) -> Command, in banner order
+        self.commands = OrderedDict()
+        self.registerCommands()
+
+        # ClientConnection objects for everyone currently connected
+        self.connections = set()
+        self.loop = None
+
+    def serve(self, serversocket):
+        # Blocking; run this on its own thread
+        asyncio.run(self.run(serversocket))
+
+    async def run(self, serversocket):
+        # New samples are appended to the store on another thread
+        self.loop = asyncio.get_running_loop()
+        self.sensorStore.addListener(self.onData)
+        if(self.alertEngine is not None):
+            self.alertEngine.addListener(self.onAlerts)
+
+        server = await asyncio.start_server(self.handleClient, sock=serversocket)
+        async with server:
+            await server.serve_forever()
+
+    def onData(self, count):
+        # Runs on the store writer's thread; hand over to the event loop
+        self.loop.call_soon_threadsafe(self.dataChanged)
+
+    def onAlerts(self, events):
+        # Runs on the store writer's thread, like onData
+        self.loop.call_soon_threadsafe(self.pushAlerts, events)
+
+    def pushAlerts(self, events):
+        # Encoded once per protocol, however many clients are listening
+        (text, frame) = (None, None)
+        for connection in self.connections:
+            if(not connection.alerts):
+                continue
+
+            if(connection.binary):
+                if(frame is None):
+                    frame = protocol.packFrame(protocol.FRAME_ALERT, protocol.packAlerts(events))
+                connection.write(frame)
+            else:
+                if(text is None):
+                    # Alert <ID> <field> <old band> <new band> <value>, one line per event
+                    text = "".join(["Alert {} {} {} {} {}\r\n".format(event.warrior, classify.FIELD_NAMES[event.field],
+                        classify.BAND_NAMES[event.oldBand], classify.BAND_NAMES[event.newBand], alerts.formatValue(event.value))
+                        for event in events]).encode()
+                connection.write(text)
+            connection.flush()
+
+    def dataChanged(self):
+        for connection in self.connections:
+            if(connection.subscription is not None):
+                connection.subscription.changed.set()
+
+    def subscribe(self, connection, rate, keyframeInterval):
+        self.unsubscribe(connection)
+        connection.subscription = Subscription(rate, keyframeInterval)
+        connection.subscription.task = asyncio.ensure_future(self.pushUpdates(connection, connection.subscription))
+
+    def unsubscribe(self, connection):
+        if(connection.subscription is not None):
+            connection.subscription.task.cancel()
+            connection.subscription = None
+
+    async def pushUpdates(self, connection, subscription):
+        try:
+            while(1):
+                await subscription.changed.wait()
+                subscription.changed.clear()
+
+                update = subscription.nextUpdate(makeSnapshot(self.sensorStore))
+                if(update is not None):
+                    self.writeUpdate(connection, update)
+                    connection.flush(snapshot=True)
+
+                # Never push faster than the subscribed rate
+                if(subscription.minInterval):
+                    await asyncio.sleep(subscription.minInterval)
+
+        except (ConnectionError, OSError):
+            pass
+
+    def writeUpdate(self, connection, update):
+        (sequence, baseSequence, data) = update
+
+        if(connection.binary):
+            if(baseSequence is None):
+                payload = protocol.packFlatSnapshot(sequence, data)
+                connection.write(protocol.packFrame(protocol.FRAME_KEYFRAME, payload))
+            else:
+                connection.write(protocol.packFrame(protocol.FRAME_DELTA, protocol.packDelta(sequence, baseSequence, data)))
+            return
+
+        if(baseSequence is None):
+            # Key <seq>, one line per warrior (ID then fields in classify order), End
+            lines = ["Key " + str(sequence)]
+            for record in data:
+                lines.append(" ".join([str(value) for value in record]))
+        else:
+            # Delta <seq> <base>, one line per changed warrior: ID field=value ..., End
+            lines = ["Delta " + str(sequence) + " " + str(baseSequence)]
+            for (warrior, field, value) in data:
+                if(len(lines) > 1 and lines[-1].split(" ", 1)[0] == str(warrior)):
+                    lines[-1] += " " + classify.FIELD_NAMES[field] + "=" + str(value)
+                else:
+                    lines.append(str(warrior) + " " + classify.FIELD_NAMES[field] + "=" + str(value))
+        lines.append("End\r\n")
+        connection.write("\r\n".join(lines).encode())
+
+    def register(self, name, handler, usage=None):
+        # Add or replace a command; name is matched case-insensitively
+        self.commands[name.lower()] = Command(handler, usage if usage is not None else name)
+
+    def registerCommands(self):
+        self.register("Ping", self.ping)
+        self.register("Poll", self.poll, "Poll [ids=1,3] [fields=ammo,weapon] [band>=red]")
+        self.register("Shutdown", self.shutdown)
+        self.register("Binary", self.binary)
+        self.register("Subscribe", self.subscribeCommand, "Subscribe [rate] [keyframe]")
+        self.register("Unsubscribe", self.unsubscribeCommand)
+        self.register("Ack", self.ack, "Ack <seq>")
+        self.register("History", self.history, "History <warrior> <field> <window> [points]")
+        self.register("Stats", self.statsCommand)
+        self.register("Resync", self.resync)
+        self.register("Alerts", self.alertsCommand, "Alerts on|off")
+        self.register("Compress", self.compress, "Compress [budget ms] [level]|off")
+        self.register("Help", self.help)
+
+    def banner(self):
+        return BANNER_HEADER + "\r\n".join([command.usage for command in self.commands.values()])
+
+    async def handleClient(self, reader, writer):
+        connection = ClientConnection(reader, writer, self.slowConsumerPolicy)
+        self.connections.add(connection)
+        address = connection.address
+        parser = CommandParser()
+
+        # Reply to connection
+        self.messagePrintService.printClientMessage("Connection Success with {}:{}".format(str(address[0]), str(address[1])))
+
+        try:
+            connection.write(WELCOME_MESSAGE.encode("utf-8"))
+            connection.write("Connection from {}:{} to {}:{}".format(str(address[0]), str(address[1]), self.host, self.port).encode("utf-8"))
+            connection.send((self.banner() + COMMAND_PROMPT).encode())
+
+            connected = True
+            while(connected):
+                # Receive whatever the client has sent, possibly several commands
+                start = stats.now()
+                data = await connection.recv()
+                if(not data): #< Client disconnected
+                    break
+                RECV_WAIT.recordSince(start)
+                parser.feed(data)
+
+                # Replies are written in order and go out in one write
+                while(connected):
+                    command = parser.next()
+                    if(command is None):
+                        break
+                    connected = self.dispatch(connection, parser, command)
+                connection.flush()
+
+        except (ConnectionError, OSError, ValueError) as e: #< Unexpected disconnection or a bad frame
+            self.messagePrintService.printClientMessage(str(e))
+
+        finally:
+            self.unsubscribe(connection)
+            self.connections.discard(connection)
+            connection.close()
+            self.messagePrintService.printClientMessage("{} disconnected: {}".format(str(address[0]), connection.stats.summary()))
+
+    def dispatch(self, connection, parser, data):
+        # Returns False when the connection should be closed
+        address = connection.address
+        if(self.recorder is not None):
+            self.recorder.recordCommand("{}:{}".format(str(address[0]), str(address[1])), data)
+
+        start = time.perf_counter()
+        arguments = data.split()
+        command = self.commands.get(arguments[0].lower())
+        if(command is None):
+            connection.writeText("Unknown command: " + arguments[0] + " (Help lists them)\r\n")
+            result = None
+        else:
+            result = command.handler(connection, arguments)
+
+        # A Binary command switches the rest of the stream to frames
+        if(connection.binary and not parser.frames):
+            parser.useFrames()
+        elif(not connection.binary and result is not False):
+            connection.write(COMMAND_PROMPT.encode())
+
+        connection.stats.recordCommand(time.perf_counter() - start)
+        DISPATCH_TIME.record(int((time.perf_counter() - start) * 1e9))
+        COMMANDS.add()
+        return result is not False
+
+    ### <<< COMMANDS >>> ###
+    # Each takes (connection, arguments) with arguments[0] the command name
+    def ping(self, connection, arguments):
+        self.messagePrintService.printClientMessage("Ping request from " + str(connection.address[0]))
+        if(connection.binary):
+            connection.writeText("Pong")
+        else:
+            connection.write("\n{}: Pong\r\n".format(self.host).encode())
+
+    def poll(self, connection, arguments):
+        self.messagePrintService.printClientMessage("Poll request from " + str(connection.address[0]))
+        try:
+            query = PollQuery(arguments[1:])
+        except ValueError as e:
+            connection.writeText(str(e) + "\r\nUsage: " + self.commands["poll"].usage + "\r\n")
+            return
+
+        sequence = self.sensorStore.count
+        (ids, values) = query.select(self.sensorStore, self.classifier)
+
+        if(connection.binary):
+            if(query.fields is None):
+                payload = protocol.packArraySnapshot(sequence, ids, values)
+                connection.write(protocol.packFrame(protocol.FRAME_SNAPSHOT, payload))
+            else:
+                payload = protocol.packProjection(sequence, ids, values, query.mask())
+                connection.write(protocol.packFrame(protocol.FRAME_PROJECTION, payload))
+            return
+
+        rows = sensorstore.toNumbers(values)
+        if(query.fields is None):
+            # [ID, ammo, water, [hr, spo2, temp, resp], weapon] per warrior, as ever
+            lines = [str(sensorstore.nestRecord([warrior] + row)) for (warrior, row) in zip(ids.tolist(), rows)]
+        else:
+            # ID field=value ... per warrior, only the requested fields
+            lines = [" ".join([str(warrior)] + [classify.FIELD_NAMES[field] + "=" + str(row[field]) for field in query.fields])
+                     for (warrior, row) in zip(ids.tolist(), rows)]
+        connection.write(("\n{}: ".format(self.host) + "".join([line + "\r\n" for line in lines])).encode())
+
+    def shutdown(self, connection, arguments):
+        self.messagePrintService.printClientMessage("Shutdown commanded from " + str(connection.address))
+        return False
+
+    def binary(self, connection, arguments):
+        # Acknowledge in text, then switch this connection to frames
+        self.messagePrintService.printClientMessage("Binary protocol for " + str(connection.address[0]))
+        if(not connection.binary):
+            connection.write(protocol.BINARY_ACK.encode())
+            connection.binary = True
+
+    def subscribeCommand(self, connection, arguments):
+        # Subscribe [rate] [keyframe interval]
+        try:
+            rate = float(arguments[1]) if len(arguments) > 1 else SUBSCRIBE_RATE
+            keyframeInterval = int(arguments[2]) if len(arguments) > 2 else KEYFRAME_INTERVAL
+            if(not math.isfinite(rate) or rate <= 0 or keyframeInterval < 1):
+                raise ValueError(arguments)
+        except ValueError:
+            connection.writeText("Usage: " + self.commands["subscribe"].usage + "\r\n")
+            return
+
+        self.messagePrintService.printClientMessage("Subscribe from " + str(connection.address[0]))
+        self.subscribe(connection, rate, keyframeInterval)
+
+    def unsubscribeCommand(self, connection, arguments):
+        self.unsubscribe(connection)
+
+    def ack(self, connection, arguments):
+        # Ack <seq>: later deltas are encoded against this snapshot
+        if(connection.subscription is not None and len(arguments) > 1 and arguments[1].isdigit()):
+            connection.subscription.acknowledge(int(arguments[1]))
+
+    def history(self, connection, arguments):
+        self.messagePrintService.printClientMessage("History request from " + str(connection.address[0]))
+        self.writeHistory(connection, arguments[1:])
+
+    def resync(self, connection, arguments):
+        # Full snapshot tagged with the store version that multicast
+        # datagrams carry, for a receiver that detected a gap
+        self.messagePrintService.printClientMessage("Resync request from " + str(connection.address[0]))
+        store = self.sensorStore
+        if(connection.binary):
+            payload = protocol.packArraySnapshot(store.count, store.ids, store.latest())
+            connection.write(protocol.packFrame(protocol.FRAME_SNAPSHOT, payload))
+        else:
+            # Resync <version>, one line per warrior (ID then fields in classify order), End
+            lines = ["Resync " + str(store.count)]
+            for record in store.flatRecords():
+                lines.append(" ".join([str(value) for value in record]))
+            lines.append("End\r\n")
+            connection.write("\r\n".join(lines).encode())
+
+    def alertsCommand(self, connection, arguments):
+        # Alerts on|off
+        if(len(arguments) < 2 or arguments[1].lower() not in ("on", "off")):
+            connection.writeText("Usage: " + self.commands["alerts"].usage + "\r\n")
+        elif(self.alertEngine is None):
+            connection.writeText("Alerts are not enabled on this server\r\n")
+        else:
+            connection.alerts = arguments[1].lower() == "on"
+            connection.writeText("Alerts " + arguments[1].lower() + "\r\n")
+
+    def compress(self, connection, arguments):
+        # Compress [budget ms] [level] | Compress off
+        if(len(arguments) > 1 and arguments[1].lower() == "off"):
+            # The ack is the last thing compressed, so the client knows to switch back
+            connection.writeText("Compress off\r\n")
+            connection.stopCompression()
+            return
+
+        try:
+            budget = float(arguments[1]) / 1000 if len(arguments) > 1 else COMPRESS_BUDGET
+            level = int(arguments[2]) if len(arguments) > 2 else protocol.COMPRESS_LEVEL
+            if(budget < 0 or not -1 <= level <= 9):
+                raise ValueError
+        except ValueError:
+            connection.writeText("Usage: " + self.commands["compress"].usage + "\r\n")
+            return
+
+        # Acknowledged uncompressed; FRAME_COMPRESSED from the next byte on
+        self.messagePrintService.printClientMessage("Compress request from " + str(connection.address[0]))
+        if(connection.compressor is None):
+            connection.writeText(protocol.COMPRESS_ACK)
+            connection.startCompression(budget, level)
+        else:
+            connection.budget = budget
+            connection.writeText(protocol.COMPRESS_ACK)
+
+    def statsCommand(self, connection, arguments):
+        # Latency percentiles and counters for this process (and any others
+        # forwarding theirs, see sharedstate.forwardStats), then this connection
+        self.messagePrintService.printClientMessage("Stats request from " + str(connection.address[0]))
+        connection.writeText("\r\n".join(stats.registry.report() + ["connection " + connection.stats.summary()]) + "\r\n")
+
+    def help(self, connection, arguments):
+        connection.writeText(self.banner())
+
+    def writeHistory(self, connection, arguments):
+        # History <warrior ID> <field> <window> [points]
+        try:
+            warrior = self.sensorStore.idIndex[int(arguments[0])]
+            field = classify.FIELD_NAMES.index(arguments[1].lower())
+            seconds = parseSeconds(arguments[2])
+            points = int(arguments[3]) if len(arguments) > 3 else HISTORY_POINTS
+        except (IndexError, KeyError, ValueError):
+            connection.writeText("Usage: History <warrior> <" + "|".join(classify.FIELD_NAMES) + "> <window> [points]\r\n")
+            return
+
+        # Reply size depends on points, not on how much history the window covers
+        points = max(1, min(points, MAX_HISTORY_POINTS))
+        (times, values) = self.sensorStore.window(warrior, field, seconds)
+        (times, minimums, maximums, means) = sensorstore.downsample(times, values, points)
+        offsets = times - self.sensorStore.latestTime()
+        warriorId = int(self.sensorStore.ids[warrior])
+
+        if(connection.binary):
+            payload = protocol.packHistory(warriorId, field, offsets, minimums, maximums, means)
+            connection.write(protocol.packFrame(protocol.FRAME_HISTORY, payload))
+            return
+
+        # History <ID> <field> <buckets>, then "offset min max mean" per bucket, End
+        lines = ["History " + str(warriorId) + " " + classify.FIELD_NAMES[field] + " " + str(len(offsets))]
+        for bucket in zip(offsets, minimums, maximums, means):
+            lines.append(" ".join(["%.6g" % value for value in bucket]))
+        lines.append("End\r\n")
+        connection.write("\r\n".join(lines).encode())
@@ -0,0 +1,222 @@
+"""
+Title: Augmented Warfighter Awareness System Shared State
+Team: UCCS Senior Design "Heads Up" 2020
+
+Purpose: This file lets ingest, render and network run as separate
+         processes (main.py PIPELINE = PROCESS_PIPELINE) so the render loop
+         no longer competes with the server for one GIL. The SensorStore
+         arrays live in a multiprocessing.shared_memory block: the ingest
+         process appends, the others attach by name and read in place.
+         Client messages for the message pane travel over a queue to the
+         render process, and the other processes' stats reports over
+         another to the network process for the Stats command.
+
+"""
+from multiprocessing import shared_memory
+from queue import Full
+from threading import Thread
+import time
+import numpy as np
+import classify
+import stats
+from sensorstore import SensorStore, HISTORY_LENGTH, VALUE_TYPE
+
+### <<< LAYOUT >>> ###
+# [header][slot versions][times][ids][values], each array as in SensorStore
+HEADER                  =   np.dtype([("count", "<i8"), ("warriors", "<i8"), ("history", "<i8")])
+WRITING                 =   -1      # Slot version while a sample is being written
+
+### <<< READERS >>> ###
+FOLLOW_INTERVAL         =   0.01    # Seconds between checks for a new sample
+MAX_MESSAGES            =   1000    # Client messages waiting for the render process
+STATS_INTERVAL          =   1.0     # Seconds between stats reports to the network process
+MAX_STATS_REPORTS       =   16      # Reports waiting for the network process
+
+def layout(warriors, history):
+    # -> (offsets of versions, times, ids, values), total size in bytes
+    slots = 2 * history
+    versions = HEADER.itemsize
+    times = versions + 8 * slots
+    ids = times + 8 * slots
+    values = ids + 8 * warriors
+    size = values + np.dtype(VALUE_TYPE).itemsize * warriors * classify.FIELD_TOTAL * slots
+    return ((versions, times, ids, values), size)
+
+class SharedSensorStore(SensorStore):
+    """ A SensorStore whose arrays are views of a shared memory block.
+
+        Pass ids to create the block (the one process that appends), or
+        the block's name to attach to it. Every ring buffer slot has a
+        version: WRITING while append() fills it, then the number of the
+        sample it holds, and count is published only after that. latest()
+        copies just the rows asked for and checks the version before and
+        after, retrying if the writer got to the slot in between, so a
+        reader never sees a torn sample and the writer never waits.
+        history() (and so window()) checks every slot it copies the same way.
+
+        Listeners added in a reading process are called from follow(),
+        which polls count, rather than by append(). """
+
+    def __init__(self, ids=None, history=HISTORY_LENGTH, name=None):
+        if(name is None):
+            ids = np.array(ids, dtype=np.int64)
+            (offsets, size) = layout(len(ids), history)
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+            self.unlinked = False
+        else:
+            self.memory = shared_memory.SharedMemory(name)
+            self.owner = False
+
+        buffer = self.memory.buf
+        self.header = np.ndarray(1, dtype=HEADER, buffer=buffer)
+        if(self.owner):
+            self.header[0] = (0, len(ids), history)
+
+        warriors = int(self.header["warriors"][0])
+        self.capacity = int(self.header["history"][0])
+        slots = 2 * self.capacity
+        ((versions, times, idsOffset, values), size) = layout(warriors, self.capacity)
+
+        self.versions = np.ndarray(slots, dtype=np.int64, buffer=buffer, offset=versions)
+        self.times = np.ndarray(slots, dtype=np.float64, buffer=buffer, offset=times)
+        self.ids = np.ndarray(warriors, dtype=np.int64, buffer=buffer, offset=idsOffset)
+        self.values = np.ndarray((warriors, classify.FIELD_TOTAL, slots), dtype=VALUE_TYPE, buffer=buffer, offset=values)
+        if(self.owner):
+            self.ids[:] = ids
+            self.versions[:] = WRITING
+            self.values[:] = np.nan
+
+        self.idIndex = dict([(int(warriorId), i) for (i, warriorId) in enumerate(self.ids)])
+        self.listeners = []
+        self.retries = stats.registry.counter("shared.retries")
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    @property
+    def count(self):
+        return int(self.header["count"][0])
+
+    def append(self, values, timestamp=None):
+        # Only ever called in the process that created the block
+        if(timestamp is None):
+            timestamp = time.time()
+
+        count = self.count
+        slot = count % self.capacity
+        self.versions[slot] = self.versions[slot + self.capacity] = WRITING
+        self.values[:, :, slot] = values
+        self.values[:, :, slot + self.capacity] = values
+        self.times[slot] = self.times[slot + self.capacity] = timestamp
+        self.versions[slot] = self.versions[slot + self.capacity] = count
+
+        # Publish only once the sample and its version are written
+        self.header["count"] = count + 1
+        for listener in self.listeners:
+            listener(count + 1)
+
+    def latest(self, first=0, last=None):
+        # (warriors, FIELD_TOTAL) copy of the newest sample, only these rows
+        while(1):
+            count = self.count
+            if(not count): #< Nothing written yet; no warrior has reported
+                return np.full_like(self.values[first:last, :, 0], np.nan)
+
+            slot = (count - 1) % self.capacity + self.capacity
+            if(self.versions[slot] == count - 1):
+                values = self.values[first:last, :, slot].copy()
+                if(self.versions[slot] == count - 1):
+                    return values
+            self.retries.add()
+
+    def history(self, warrior, field, samples=None):
+        # (times, values) copies of the newest `samples` readings, oldest first
+        while(1):
+            count = self.count
+            available = min(count, self.capacity)
+            wanted = available if samples is None or samples > available else samples
+
+            # Slots end - wanted .. end - 1 must hold samples count - wanted .. count - 1
+            end = (count - 1) % self.capacity + self.capacity + 1
+            expected = np.arange(count - wanted, count)
+            if(np.array_equal(self.versions[end - wanted : end], expected)):
+                times = self.times[end - wanted : end].copy()
+                values = self.values[warrior, field, end - wanted : end].copy()
+                if(np.array_equal(self.versions[end - wanted : end], expected)):
+                    return (times, values)
+            self.retries.add()
+
+    def follow(self, interval=FOLLOW_INTERVAL):
+        # In a reading process: call listeners when a new sample is published
+        Thread(target=self.watch, args=(interval,), daemon=True).start()
+
+    def watch(self, interval):
+        seen = self.count
+        while(1):
+            time.sleep(interval)
+            count = self.count
+            if(count != seen):
+                seen = count
+                for listener in self.listeners:
+                    listener(count)
+
+    def unlink(self):
+        # Owner only: remove the block's name so it is freed once every
+        # process has let go of it; mappings already open stay valid
+        if(self.owner and not self.unlinked):
+            self.unlinked = True
+            self.memory.unlink()
+
+    def close(self):
+        # Drop the arrays first; the block can't close while views exist
+        del self.header, self.versions, self.times, self.ids, self.values
+        self.memory.close()
+        self.unlink()
+
+### <<< MESSAGE PANE >>> ###
+class MessageForwarder(object):
+    """ Stands in for display.MessagePrintService in a process without the
+        display: messages are queued for the render process, and dropped
+        rather than waited on if it falls behind. """
+
+    def __init__(self, messageQueue):
+        self.messageQueue = messageQueue
+        self.dropped = stats.registry.counter("shared.messagesDropped")
+
+    def printClientMessage(self, message):
+        try:
+            self.messageQueue.put_nowait(message)
+        except Full:
+            self.dropped.add()
+
+def receiveMessages(messageQueue, messagePrintService):
+    # In the render process: hand forwarded messages to the real pane
+    def run():
+        while(1):
+            messagePrintService.printClientMessage(messageQueue.get())
+
+    Thread(target=run, daemon=True).start()
+
+### <<< STATS >>> ###
+def forwardStats(statsQueue, label, interval=STATS_INTERVAL):
+    # In a process without the server: send its stats report every interval
+    def run():
+        while(1):
+            time.sleep(interval)
+            try:
+                statsQueue.put_nowait((label, stats.registry.report()))
+            except Full:
+                pass #< The next report supersedes it anyway
+
+    Thread(target=run, daemon=True).start()
+
+def receiveStats(statsQueue):
+    # In the network process: keep each process's latest report for Stats
+    def run():
+        while(1):
+            (label, lines) = statsQueue.get()
+            stats.registry.remote[label] = lines
+
+    Thread(target=run, daemon=True).start()
@@ -0,0 +1,120 @@
+"""
+Title: Augmented Warfighter Awareness System Instrumentation
+Team: UCCS Senior Design "Heads Up" 2020
+
+Purpose: This file holds the always-on timers and counters for the hot
+         paths (rendering, terminal writes, client commands). Timings go
+         into fixed-bucket histograms so recording one is a clock read, a
+         bisect and an increment, cheap enough to leave on in the field.
+         The Stats command reports them to a client.
+
+"""
+import time
+from bisect import bisect_left
+
+### <<< HISTOGRAM BUCKETS >>> ###
+# Upper bucket edges in nanoseconds: four per power of two from 1us to ~67s
+BUCKETS_PER_DOUBLING    =   4
+FIRST_EDGE_NS           =   1000
+BUCKET_EDGES_NS         =   [int(FIRST_EDGE_NS * 2.0 ** (i / BUCKETS_PER_DOUBLING)) for i in range(26 * BUCKETS_PER_DOUBLING + 1)]
+
+REPORT_PERCENTILES      =   [50, 95, 99]
+
+now = time.perf_counter_ns
+
+class Histogram(object):
+    """ Latency histogram over BUCKET_EDGES_NS. Counts are updated without
+        a lock, so a sample can be lost when two threads record at the same
+        instant; that is the price of staying cheap. Percentiles are
+        reported as the upper edge of the bucket they fall in (within 19%). """
+
+    def __init__(self, name):
+        self.name = name
+        self.counts = [0] * (len(BUCKET_EDGES_NS) + 1)
+        self.total = 0
+        self.totalNs = 0
+        self.maxNs = 0
+
+    def record(self, ns):
+        self.counts[bisect_left(BUCKET_EDGES_NS, ns)] += 1
+        self.total += 1
+        self.totalNs += ns
+        if(ns > self.maxNs):
+            self.maxNs = ns
+
+    def recordSince(self, startNs):
+        self.record(now() - startNs)
+
+    def percentile(self, p):
+        target = self.total * p / 100.0
+        seen = 0
+        for (bucket, count) in enumerate(self.counts):
+            seen += count
+            if(count and seen >= target):
+                return min(BUCKET_EDGES_NS[bucket], self.maxNs) if bucket < len(BUCKET_EDGES_NS) else self.maxNs
+        return 0
+
+    def summary(self):
+        # name count pN... mean max, times in microseconds
+        if(not self.total):
+            return self.name + " 0"
+        values = ["p" + str(p) + "=" + formatUs(self.percentile(p)) for p in REPORT_PERCENTILES]
+        values.append("mean=" + formatUs(self.totalNs / self.total))
+        values.append("max=" + formatUs(self.maxNs))
+        return self.name + " " + str(self.total) + " " + " ".join(values)
+
+class Counter(object):
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+
+    def add(self, amount=1):
+        self.value += amount
+
+    def summary(self):
+        return self.name + " " + str(self.value)
+
+class StatsRegistry(object):
+    """ Every histogram, counter and gauge in the process, by name. Gauges
+        are callables read only when a report is made, for values something
+        else already counts (e.g. the terminal writer's drop count). """
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+        # Process label -> report lines forwarded from another process
+        # (see sharedstate.forwardStats)
+        self.remote = {}
+
+    def histogram(self, name):
+        if(name not in self.histograms):
+            self.histograms[name] = Histogram(name)
+        return self.histograms[name]
+
+    def counter(self, name):
+        if(name not in self.counters):
+            self.counters[name] = Counter(name)
+        return self.counters[name]
+
+    def gauge(self, name, read):
+        self.gauges[name] = read
+
+    def report(self):
+        # One line per metric, histograms first, each group sorted by name
+        lines = ["Latency (us): name count " + " ".join(["p" + str(p) for p in REPORT_PERCENTILES]) + " mean max"]
+        lines += [self.histograms[name].summary() for name in sorted(self.histograms)]
+        lines.append("Counters:")
+        lines += [self.counters[name].summary() for name in sorted(self.counters)]
+        lines += [name + " " + str(self.gauges[name]()) for name in sorted(self.gauges)]
+        for label in sorted(self.remote):
+            lines.append(label.capitalize() + " process:")
+            lines += self.remote[label]
+        return lines
+
+def formatUs(ns):
+    return "{:.1f}".format(ns / 1000.0)
+
+# Shared by everything in the process
+registry = StatsRegistry()
@@ -0,0 +1,112 @@
+"""
+Title: Augmented Warfighter Awareness System Classifier Regression Test
+Team: UCCS Senior Design "Heads Up" 2020
+
+Purpose: This file checks ThresholdClassifier against the if/elif ladders
+         displayData used before the threshold table, on a 0.1 step grid
+         for every field. Run with "python -m unittest test_classify" (or
+         pytest) from rPi-Code.
+
+"""
+import unittest
+import numpy as np
+import classify
+from classify import BAND_GREEN, BAND_AMBER, BAND_RED, BAND_BLACK
+import display
+
+### <<< GRID >>> ###
+GRID_LOW                =   -10.0
+GRID_HIGH               =   300.0
+GRID_STEP               =   0.1
+
+#< BASELINE LADDERS >#
+# As they were in displayData; None where no branch matched (the cell kept
+# the previous pen color, which the classifier replaced with a defined band)
+def ladderHigherIsBetter(value, green, amber, red, black):
+    if(value > amber and value <= green):
+        return BAND_GREEN
+    elif(value > red and value <= amber):
+        return BAND_AMBER
+    elif(value > black and value <= red):
+        return BAND_RED
+    elif(value <= black):
+        return BAND_BLACK
+    return None
+
+def ladderTwoSided(value, green, amber, red, black):
+    if(value >= green[display.LOW] and value <= green[display.HIGH]):
+        return BAND_GREEN
+    elif((value >= amber[display.LOW] and value < green[display.LOW]) or (value > green[display.HIGH] and value <= amber[display.HIGH])):
+        return BAND_AMBER
+    elif((value >= red[display.LOW] and value < amber[display.LOW]) or (value > amber[display.HIGH] and value <= red[display.HIGH])):
+        return BAND_RED
+    elif(value <= black[display.LOW] or value >= black[display.HIGH]):
+        return BAND_BLACK
+    return None
+
+def ladderWater(value):
+    if(value > display.WATER_AMBER):
+        return BAND_GREEN
+    elif(value > display.WATER_RED and value <= display.WATER_AMBER):
+        return BAND_AMBER
+    elif(value > display.WATER_BLACK and value <= display.WATER_RED):
+        return BAND_RED
+    elif(value <= display.WATER_BLACK):
+        return BAND_BLACK
+    return None
+
+def ladderWeapon(value):
+    if(value == display.WEAPON_GREEN):
+        return BAND_GREEN
+    elif(value == display.WEAPON_AMBER):
+        return BAND_AMBER
+    elif(value > display.WEAPON_RED):
+        return BAND_RED
+    elif(value >= display.WEAPON_BLACK[display.LOW] or value <= display.WEAPON_BLACK[display.HIGH]):
+        return BAND_BLACK
+    return None
+
+LADDERS = [None] * classify.FIELD_TOTAL
+LADDERS[classify.FIELD_AMMO] = lambda value: ladderHigherIsBetter(value, display.AMMO_GREEN, display.AMMO_AMBER, display.AMMO_RED, display.AMMO_BLACK)
+LADDERS[classify.FIELD_WATER] = ladderWater
+LADDERS[classify.FIELD_HR] = lambda value: ladderTwoSided(value, display.HR_GREEN, display.HR_AMBER, display.HR_RED, display.HR_BLACK)
+LADDERS[classify.FIELD_SPO2] = lambda value: ladderHigherIsBetter(value, display.SPO2_GREEN, display.SPO2_AMBER, display.SPO2_RED, display.SPO2_BLACK)
+LADDERS[classify.FIELD_TEMP] = lambda value: ladderTwoSided(value, display.TEMP_GREEN, display.TEMP_AMBER, display.TEMP_RED, display.TEMP_BLACK)
+LADDERS[classify.FIELD_RESP] = lambda value: ladderTwoSided(value, display.RESP_GREEN, display.RESP_AMBER, display.RESP_RED, display.RESP_BLACK)
+LADDERS[classify.FIELD_WEAPON] = ladderWeapon
+
+def validWeapon(value):
+    # Weapon status is a whole number of seconds (or 0 / 1), never negative
+    return value >= 0 and value == int(value)
+
+class ClassifierRegressionTest(unittest.TestCase):
+
+    def setUp(self):
+        steps = int(round((GRID_HIGH - GRID_LOW) / GRID_STEP))
+        self.grid = np.round(GRID_LOW + GRID_STEP * np.arange(steps + 1), 1)
+        self.classifier = classify.ThresholdClassifier()
+
+    def mismatches(self, field):
+        # -> [(value, ladder band, classifier band)] wherever the ladder picked a band
+        bands = self.classifier.classifyCells(self.grid, [field] * len(self.grid))
+        found = []
+        for (value, band) in zip(self.grid.tolist(), bands.tolist()):
+            expected = LADDERS[field](value)
+            if(expected is not None and expected != band):
+                found.append((value, expected, band))
+        return found
+
+    def test_matches_ladders(self):
+        for field in range(classify.FIELD_TOTAL):
+            found = self.mismatches(field)
+            if(field == classify.FIELD_WEAPON):
+                found = [mismatch for mismatch in found if validWeapon(mismatch[0])]
+            self.assertEqual(found, [], classify.FIELD_NAMES[field])
+
+    def test_only_invalid_weapon_values_differ(self):
+        found = self.mismatches(classify.FIELD_WEAPON)
+        self.assertTrue(found)
+        self.assertFalse([mismatch for mismatch in found if validWeapon(mismatch[0])])
+
+if __name__ == "__main__":
+    unittest.main()